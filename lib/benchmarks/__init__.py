@@ -0,0 +1,16 @@
+"""Benchmarks of the library's hot paths, in the format of airspeed velocity.
+
+Methods prefixed with `time_` measure run times, methods prefixed with
+`peakmem_` measure the peak resident memory of the process. Benchmarks are
+parametrized by the size of the inputs, which gives scaling curves. Run them
+from `lib/` with, e.g.,
+
+    asv run              # Benchmark the current commit.
+    asv continuous HEAD~1 HEAD
+    asv publish && asv preview
+
+The playerkern benchmarks of the "gp" backend need the fork of GPy with the
+Rao-Kupper link, which pip cannot install: they are skipped without it. To
+run them, benchmark the current environment with
+`asv run --environment existing`.
+"""
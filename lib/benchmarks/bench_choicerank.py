@@ -0,0 +1,75 @@
+import numpy as np
+
+from thesis.choicerank import (
+        displacement, kendall_tau, ranks, weighted_quantiles,
+        WeightedQuantileSketch)
+
+
+class Ranks:
+
+    params = [1000, 100000, 1000000]
+    param_names = ["size"]
+
+    def setup(self, size):
+        rng = np.random.default_rng(0)
+        # Many ties, which are broken at random.
+        self.vals = rng.integers(size // 10 + 1, size=size)
+        self.rows = self.vals.reshape(10, -1)
+
+    def time_ranks(self, size):
+        ranks(self.vals, rng=np.random.default_rng(0))
+
+    def time_ranks_rows(self, size):
+        ranks(self.rows, rng=np.random.default_rng(0))
+
+    def peakmem_ranks(self, size):
+        ranks(self.vals, rng=np.random.default_rng(0))
+
+
+class Metrics:
+
+    params = [1000, 100000, 1000000]
+    param_names = ["size"]
+
+    def setup(self, size):
+        rng = np.random.default_rng(0)
+        self.vals1 = rng.normal(size=size)
+        self.vals2 = self.vals1 + rng.normal(size=size)
+
+    def time_displacement(self, size):
+        displacement(self.vals1, self.vals2, rng=np.random.default_rng(0))
+
+    def time_kendall_tau(self, size):
+        kendall_tau(self.vals1, self.vals2, rng=np.random.default_rng(0))
+
+    def peakmem_kendall_tau(self, size):
+        kendall_tau(self.vals1, self.vals2, rng=np.random.default_rng(0))
+
+
+class WeightedQuantiles:
+
+    params = [1000, 100000, 1000000]
+    param_names = ["size"]
+
+    def setup(self, size):
+        rng = np.random.default_rng(0)
+        self.data = rng.normal(size=size)
+        self.weights = rng.exponential(size=size)
+        self.fractions = np.linspace(0.01, 0.99, 99)
+
+    def time_weighted_quantiles(self, size):
+        weighted_quantiles(self.data, self.weights, self.fractions)
+
+    def time_weighted_quantiles_rows(self, size):
+        weighted_quantiles(self.data.reshape(10, -1),
+                self.weights.reshape(10, -1), self.fractions, axis=1)
+
+    def peakmem_weighted_quantiles(self, size):
+        weighted_quantiles(self.data, self.weights, self.fractions)
+
+    def time_sketch(self, size):
+        sketch = WeightedQuantileSketch()
+        for start in range(0, size, 10000):
+            sketch.update(self.data[start:start+10000],
+                    self.weights[start:start+10000])
+        sketch.quantiles(self.fractions)
@@ -0,0 +1,45 @@
+from thesis.playerkern import ActorGPModel, GameData, Game, TeamGPModel
+
+from .datasets import games_db
+
+
+class PlayerKern:
+
+    """Feature matrices, fits and predictions on a synthetic database.
+
+    Models are trained on the first 80% of the games and predict the rest.
+    """
+
+    params = ([200, 1000], ["actors", "teams"], ["gp", "weights"])
+    param_names = ["n_games", "model", "backend"]
+    timeout = 600
+
+    def setup(self, n_games, model, backend):
+        if backend == "gp":
+            try:
+                import GPy
+            except ImportError:
+                # Skips the benchmark.
+                raise NotImplementedError("the GPy fork is not installed")
+        games_db(n_games)
+        self.cls = ActorGPModel if model == "actors" else TeamGPModel
+        games = Game.select().order_by(Game.kickoff_time)
+        self.train = GameData.from_games(games.limit(n_games * 4 // 5))
+        self.test = GameData.from_games(games.offset(n_games * 4 // 5))
+        self.fitted = self.cls(0.5)
+        self.fitted.fit(self.train, backend=backend)
+
+    def time_load_games(self, n_games, model, backend):
+        GameData.from_games(Game.select())
+
+    def time_feature_matrix(self, n_games, model, backend):
+        self.cls(0.5)._prepare(self.train)
+
+    def time_fit(self, n_games, model, backend):
+        self.cls(0.5).fit(self.train, backend=backend)
+
+    def peakmem_fit(self, n_games, model, backend):
+        self.cls(0.5).fit(self.train, backend=backend)
+
+    def time_predict(self, n_games, model, backend):
+        self.fitted.predict_many(self.test)
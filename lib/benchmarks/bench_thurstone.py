@@ -0,0 +1,46 @@
+from thesis.thurstone import thurstone_mle
+
+from .datasets import comparisons
+
+
+class ThurstoneMLE:
+
+    """Scaling of `thurstone_mle` with the number of items and comparisons."""
+
+    params = ([100, 1000, 10000], [5, 50], ["BFGS", "Newton-CG"])
+    param_names = ["n_items", "density", "method"]
+    timeout = 300
+
+    def setup(self, n_items, density, method):
+        if method == "BFGS" and n_items > 100:
+            # BFGS updates a dense approximation of the inverse Hessian,
+            # and takes minutes beyond a few hundred items.
+            raise NotImplementedError()
+        self.data = comparisons(n_items, density)
+
+    def time_mle(self, n_items, density, method):
+        thurstone_mle(self.data, n_items=n_items, method=method)
+
+    def peakmem_mle(self, n_items, density, method):
+        thurstone_mle(self.data, n_items=n_items, method=method)
+
+    def time_mle_variances(self, n_items, density, method):
+        thurstone_mle(self.data, n_items=n_items, method=method,
+                return_var="diagonal")
+
+
+class ThurstoneMLELarge:
+
+    """Sparse fit with 50,000 items and 2.5 million comparisons.
+
+    Default settings: Newton-CG, `penalty=1e-6`, `tol=1e-5`. The run time is
+    proportional to the number of iterations, which depends on the data.
+    """
+
+    timeout = 600
+
+    def setup(self):
+        self.data = comparisons(50000, 100)
+
+    def time_mle(self):
+        thurstone_mle(self.data, n_items=50000)
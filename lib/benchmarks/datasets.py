@@ -0,0 +1,63 @@
+"""Synthetic datasets shared by the benchmarks."""
+import datetime
+import numpy as np
+
+
+def comparisons(n_items, density, seed=0):
+    """Comparisons generated by Thurstone's model.
+
+    Each item takes part in `density` comparisons on average. Returns a
+    tuple `(winners, losers)`.
+    """
+    rng = np.random.default_rng(seed)
+    params = rng.normal(size=n_items)
+    n_comps = n_items * density // 2
+    i = rng.integers(n_items, size=n_comps)
+    j = (i + rng.integers(1, n_items, size=n_comps)) % n_items
+    wins = params[i] - params[j] + rng.normal(size=n_comps) > 0
+    return np.where(wins, i, j), np.where(wins, j, i)
+
+
+def games_db(n_games, n_teams=20, squad_size=25, seed=0):
+    """Fill an in-memory SQLite database with random games.
+
+    Each team has a squad of actors; in each game, 11 of them start and
+    the others are substitutes. Scores depend on the strengths of the teams.
+    """
+    from thesis.playerkern.data_models import (
+            init_db, Actor, Game, Participant, Team, DB_PROXY)
+    from thesis.playerkern.ingest import load_records
+    rng = np.random.default_rng(seed)
+    init_db("sqlite:///:memory:")
+    DB_PROXY.create_tables([Team, Actor, Game, Participant], safe=True)
+    load_records(Team, [{"swid": t, "name": "team{}".format(t)}
+            for t in range(n_teams)])
+    load_records(Actor, [{"swid": a} for a in range(n_teams * squad_size)])
+    strength = rng.normal(size=n_teams)
+    start = datetime.datetime(2010, 1, 1)
+    games, parts = list(), list()
+    for g in range(n_games):
+        home, away = rng.choice(n_teams, size=2, replace=False).tolist()
+        diff = strength[home] - strength[away]
+        games.append({
+            "swid": g,
+            "team_home_swid": home,
+            "team_away_swid": away,
+            "kickoff_time": start + datetime.timedelta(days=g),
+            "score_home_ft": int(rng.poisson(np.exp(0.3 + 0.3 * diff))),
+            "score_away_ft": int(rng.poisson(np.exp(0.1 - 0.3 * diff))),
+            "is_neutral": bool(rng.random() < 0.1),
+        })
+        for team in (home, away):
+            squad = team * squad_size + rng.permutation(squad_size)
+            for k, actor in enumerate(squad[:14].tolist()):
+                parts.append({
+                    "game_swid": g,
+                    "team_swid": team,
+                    "actor_swid": actor,
+                    "is_coach": False,
+                    "is_starter": k < 11,
+                    "ratio": 1.0 if k < 11 else 0.5,
+                })
+    load_records(Game, games)
+    load_records(Participant, parts)
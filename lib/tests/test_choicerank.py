@@ -0,0 +1,118 @@
+import numpy as np
+
+from thesis.choicerank import (
+        displacement, kendall_tau, ranks, spearman_rho, top_k_overlap,
+        weighted_quantiles, WeightedQuantileSketch)
+
+
+RND = np.random.RandomState(42)
+
+
+def test_ranks():
+    """Largest value should get rank 1, ties broken at random."""
+    assert np.array_equal(ranks([0.1, 3.0, -2.0, 0.5]), [3, 1, 4, 2])
+    seen = set()
+    for seed in range(20):
+        seen.add(tuple(ranks([1.0, 2.0, 1.0], rng=seed)))
+    assert seen == {(2, 1, 3), (3, 1, 2)}
+    assert np.array_equal(ranks([1, 1, 1], rng=3), ranks([1, 1, 1], rng=3))
+
+
+def test_ranks_dtypes():
+    """Unsigned and boolean values should be ranked like signed ones."""
+    assert np.array_equal(ranks(np.array([0, 1, 2], dtype=np.uint8)),
+            [3, 2, 1])
+    res = ranks(np.array([True, False, True]), rng=0)
+    assert res[1] == 3 and set(res[[0, 2]]) == {1, 2}
+
+
+def test_ranks_rows():
+    """Each row of a 2-D array should be ranked separately."""
+    vals = RND.randn(10, 50)
+    res = ranks(vals)
+    assert res.shape == vals.shape
+    for row, expected in zip(res, vals):
+        assert np.array_equal(row, ranks(expected))
+
+
+def test_metrics():
+    """Metrics should match naive implementations, row by row."""
+    from scipy.stats import kendalltau, spearmanr
+    truth = RND.randn(37)
+    estimates = truth + RND.randn(20, 37)
+    taus = kendall_tau(truth, estimates)
+    rhos = spearman_rho(truth, estimates)
+    dps = displacement(truth, estimates)
+    overlaps = top_k_overlap(truth, estimates, 5)
+    assert taus.shape == rhos.shape == dps.shape == overlaps.shape == (20,)
+    for k, est in enumerate(estimates):
+        assert np.isclose(taus[k], kendalltau(truth, est)[0])
+        assert np.isclose(rhos[k], spearmanr(truth, est)[0])
+        assert dps[k] == np.abs(ranks(truth) - ranks(est)).sum()
+        assert np.isclose(overlaps[k], len(
+                set(np.argsort(-truth)[:5]) & set(np.argsort(-est)[:5])) / 5)
+    assert np.isclose(kendall_tau(truth, truth), 1.0)
+    assert np.isclose(kendall_tau(truth, -truth), -1.0)
+    assert displacement([1, 2, 3], [3, 2, 1]) == 4
+
+
+def _naive_quantiles(data, weights, fractions):
+    ind = np.argsort(data)
+    cum_weight = np.cumsum(weights[ind])
+    res = list()
+    for fraction in fractions:
+        below = np.where(cum_weight <= fraction * cum_weight[-1])[0]
+        res.append(data[ind][below[-1] if len(below) else 0])
+    return np.array(res)
+
+
+def test_weighted_quantiles():
+    """Weighted quantiles should match a naive computation."""
+    fractions = [0.05, 0.25, 0.5, 0.75, 1.0]
+    data = RND.randn(8, 100)
+    weights = RND.randint(1, 5, size=data.shape)
+    res = weighted_quantiles(data, weights, fractions)
+    assert np.array_equal(res, _naive_quantiles(
+            data.ravel(), weights.ravel(), fractions))
+    # Largest value whose cumulative weight is at most `f` times the total.
+    assert np.array_equal(
+            weighted_quantiles([3, 1, 2], [1, 1, 2], [0.25, 0.5, 0.75, 1.0]),
+            [1, 1, 2, 3])
+    for axis in (0, 1):
+        res = weighted_quantiles(data, weights, fractions, axis=axis)
+        assert res.shape == (len(fractions), data.shape[1 - axis])
+        for k, (row, ws) in enumerate(zip(
+                np.moveaxis(data, axis, 1), np.moveaxis(weights, axis, 1))):
+            assert np.array_equal(
+                    res[:,k], _naive_quantiles(row, ws, fractions))
+
+
+def test_quantile_sketch():
+    """Merged sketches should respect their documented error bound."""
+    fractions = np.linspace(0, 1, num=21)
+    data = RND.exponential(size=20000)
+    weights = RND.randint(1, 10, size=data.shape)
+    sketches = list()
+    for part in np.array_split(np.arange(len(data)), 4):
+        sketch = WeightedQuantileSketch(size=100)
+        for chunk in np.array_split(part, 10):
+            sketch.update(data[chunk], weights[chunk])
+        sketches.append(sketch)
+    sketch = sketches[0]
+    for other in sketches[1:]:
+        sketch.merge(other)
+    assert len(sketch) < len(data) / 10
+    assert np.isclose(sketch.total_weight, weights.sum())
+    # The weight below any value is underestimated by at most `error`.
+    values = np.concatenate([vals for vals, _ in sketch._levels])
+    ws = np.concatenate([ws for _, ws in sketch._levels])
+    for x in weighted_quantiles(data, weights, fractions):
+        true = weights[data <= x].sum()
+        approx = ws[values <= x].sum()
+        assert true - sketch.error <= approx <= true
+    eps = sketch.error / sketch.total_weight
+    assert eps < 0.1
+    res = sketch.quantiles(fractions)
+    lower = weighted_quantiles(data, weights, np.maximum(fractions - eps, 0))
+    upper = weighted_quantiles(data, weights, np.minimum(fractions + eps, 1))
+    assert np.all((lower <= res) & (res <= upper))
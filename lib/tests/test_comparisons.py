@@ -0,0 +1,55 @@
+import numpy as np
+
+from thesis.comparisons import read_comparisons, ComparisonCounts
+from thesis.thurstone import thurstone_mle
+
+
+RND = np.random.RandomState(42)
+IDS = np.array(["a", "b", "c", "d", "e", "f"])
+
+
+def _events(num=500):
+    winners = RND.randint(len(IDS), size=num)
+    losers = (winners + 1 + RND.randint(len(IDS) - 1, size=num)) % len(IDS)
+    return IDS[winners], IDS[losers]
+
+
+def _dense(counts, winners, losers):
+    mat = np.zeros((counts.n_items, counts.n_items))
+    for w, l in zip(winners, losers):
+        mat[counts.items[w], counts.items[l]] += 1
+    return mat
+
+
+def test_chunked_aggregation():
+    """Aggregating chunk by chunk should give the full win-count matrix."""
+    winners, losers = _events()
+    counts = ComparisonCounts()
+    for start in range(0, len(winners), 37):
+        counts.add(winners[start:start+37], losers[start:start+37])
+    mat = _dense(counts, winners, losers)
+    assert np.array_equal(counts.to_sparse().toarray(), mat)
+    assert len(counts) == np.count_nonzero(mat)
+    assert np.allclose(
+            thurstone_mle(counts.edges(), n_items=counts.n_items),
+            thurstone_mle(mat), atol=1e-4)
+
+
+def test_read_files(tmp_path):
+    """CSV and NumPy logs should be read identically."""
+    winners, losers = _events()
+    csv_path = str(tmp_path / "log.csv")
+    with open(csv_path, "w") as f:
+        f.write("winner,loser\n")
+        for w, l in zip(winners, losers):
+            f.write("{},{}\n".format(w, l))
+    npz_path = str(tmp_path / "log.npz")
+    np.savez_compressed(npz_path, winners=winners, losers=losers)
+    npy_path = str(tmp_path / "log.npy")
+    np.save(npy_path, np.stack((winners, losers), axis=1))
+    for counts in (
+            read_comparisons(csv_path, chunksize=64, skip_header=True),
+            read_comparisons(npz_path, chunksize=64),
+            read_comparisons(npy_path, chunksize=64)):
+        mat = _dense(counts, winners, losers)
+        assert np.array_equal(counts.to_sparse().toarray(), mat)
@@ -0,0 +1,29 @@
+import json
+import subprocess
+import sys
+
+
+def _loaded_after(code):
+    # Runs `code` in a fresh interpreter, returns the loaded modules.
+    code += "\nimport json, sys\nprint(json.dumps(sorted(sys.modules)))"
+    out = subprocess.check_output([sys.executable, "-c", code])
+    return set(json.loads(out.decode().splitlines()[-1]))
+
+
+def test_lazy_imports():
+    """Importing the packages should not import heavy dependencies."""
+    loaded = _loaded_after(
+            "import thesis, thesis.choicerank, thesis.playerkern")
+    for module in ("matplotlib", "scipy.optimize", "GPy", "peewee"):
+        assert module not in loaded
+    # Names are still available, and import their dependencies on demand.
+    loaded = _loaded_after(
+            "import thesis\nassert callable(thesis.thurstone_mle)")
+    assert "scipy.optimize" in loaded
+    assert "matplotlib" not in loaded
+    loaded = _loaded_after("from thesis.choicerank import ranks, qtod")
+    assert "thesis.choicerank.utils" in loaded
+    assert "thesis.choicerank.metrics" not in loaded
+    # GPy is only needed by the "gp" backend.
+    loaded = _loaded_after("from thesis.playerkern import ActorGPModel")
+    assert "GPy" not in loaded
@@ -0,0 +1,638 @@
+import datetime
+import math
+import numpy as np
+import os
+import pytest
+
+from concurrent.futures import ThreadPoolExecutor
+from scipy.linalg import cho_factor, cho_solve
+from scipy.sparse import random as sparse_random
+from scipy.special import expit
+
+from thesis.playerkern import ingest
+from thesis.playerkern.cache import ModelCache
+from thesis.playerkern.data_models import (
+        init_db, create_indexes, Actor, Game, Participant, Prediction, Team,
+        DB_PROXY)
+from thesis.playerkern.gamedata import GameData, snapshot
+from thesis.playerkern.inference import WeightSpacePosterior
+from thesis.playerkern.ingest import load_records
+from thesis.playerkern.predictions import read_predictions, write_predictions
+from thesis.playerkern.predictive_models import (
+        ActorGPModel, PredictiveModel, TeamGPModel, _DenseInputs)
+from thesis.playerkern.tuning import grid_search
+from thesis.playerkern.utils import Features, Outcome, TestResults, TestSet
+from thesis.playerkern.walkforward import backtest
+
+
+RND = np.random.RandomState(42)
+
+START = datetime.datetime(2010, 1, 1)
+
+# Home team, away team, scores and neutral venue of each game. Team 2 has no
+# name, and the last game has no score yet.
+GAMES = [
+    (0, 1, 2, 1, False),
+    (1, 2, 0, 0, True),
+    (2, 0, 1, 3, False),
+    (0, 2, None, None, False),
+]
+
+
+@pytest.fixture
+def league():
+    # Random games between four teams of three actors, one per day; the last
+    # two have no score yet.
+    init_db("sqlite:///:memory:")
+    DB_PROXY.create_tables([Team, Actor, Game, Participant], safe=True)
+    load_records(Team, [{"swid": t, "name": "T{}".format(t)}
+            for t in range(4)])
+    load_records(Actor, [{"swid": a} for a in range(12)])
+    rng = np.random.RandomState(0)
+    games, parts = list(), list()
+    for g in range(40):
+        home, away = rng.choice(4, size=2, replace=False).tolist()
+        scores = rng.poisson(1.2, size=2).tolist() if g < 38 else [None] * 2
+        games.append({
+            "swid": g,
+            "team_home_swid": home,
+            "team_away_swid": away,
+            "score_home_ft": scores[0],
+            "score_away_ft": scores[1],
+            "is_neutral": bool(g % 5 == 0),
+            "kickoff_time": START + datetime.timedelta(days=g),
+        })
+        parts.extend({
+            "game_swid": g,
+            "team_swid": team,
+            "actor_swid": 3 * team + k,
+            "is_coach": False,
+            "is_starter": True,
+            "ratio": 1.0,
+        } for team in (home, away) for k in range(3))
+    load_records(Game, games)
+    load_records(Participant, parts)
+    yield DB_PROXY
+    DB_PROXY.close()
+
+
+@pytest.fixture
+def db():
+    init_db("sqlite:///:memory:")
+    DB_PROXY.create_tables([Team, Actor, Game, Participant], safe=True)
+    load_records(Team, [{"swid": 0, "name": "A"}, {"swid": 1, "name": "B"},
+            {"swid": 2}])
+    load_records(Actor, [{"swid": a} for a in range(6)])
+    load_records(Game, [{
+        "swid": g,
+        "team_home_swid": home,
+        "team_away_swid": away,
+        "score_home_ft": sh,
+        "score_away_ft": sa,
+        "is_neutral": neutral,
+        "kickoff_time": START + datetime.timedelta(days=g),
+    } for g, (home, away, sh, sa, neutral) in enumerate(GAMES)])
+    # Two actors per team; the second one is a substitute, who does not
+    # play in odd games.
+    load_records(Participant, [{
+        "game_swid": g,
+        "team_swid": team,
+        "actor_swid": 2 * team + k,
+        "is_coach": False,
+        "is_starter": k == 0,
+        "ratio": 1.0 if k == 0 else 0.5 * (g % 2 == 0),
+    } for g, (home, away, _, _, _) in enumerate(GAMES)
+            for team in (home, away) for k in range(2)])
+    yield DB_PROXY
+    DB_PROXY.close()
+
+
+def test_from_games(db):
+    """Columns should follow the order of the games given as input."""
+    games = list(Game.select().order_by(Game.swid.desc()))
+    data = GameData.from_games(games)
+    assert len(data) == len(GAMES)
+    assert data.id.tolist() == [game.id for game in games]
+    assert data.team_home_name.tolist() == ["A", None, "B", "A"]
+    assert data.team_away_name.tolist() == [None, "A", None, "B"]
+    assert np.isnan(data.score_home_ft[0])
+    assert data.is_neutral.tolist() == [False, False, True, False]
+    assert data.n_participants().tolist() == [4, 4, 4, 4]
+    # Participants point to the position of their game.
+    for pos, game in enumerate(games):
+        actors = {p.actor.id for p in game.participants}
+        assert set(data.part_actor[data.part_game == pos]) == actors
+    # Queries give the same columns as lists of games.
+    query = GameData.from_games(Game.select().order_by(Game.swid.desc()))
+    assert query.id.tolist() == data.id.tolist()
+    assert query.team_away_name.tolist() == data.team_away_name.tolist()
+
+
+def test_outcomes(db):
+    """Draws should give two rows, games without a score none."""
+    data = GameData.from_games(Game.select().order_by(Game.swid))
+    assert data.subset([0, 1, 2]).outcomes().tolist() == [0, 1, 2]
+    with pytest.raises(ValueError):
+        data.outcomes()
+    # Test sets skip the games without a score.
+    test_set = TestSet.from_games(data)
+    res = test_set.results(np.full((3, 3), 1.0 / 3))
+    assert res.outcomes.tolist() == [0, 1, 2]
+    row_game, row_sign = data.outcome_rows()
+    assert row_game.tolist() == [0, 1, 1, 2]
+    assert row_sign.tolist() == [1.0, 1.0, -1.0, -1.0]
+    entry_row, part = data.expand(row_game)
+    assert entry_row.tolist() == np.repeat(np.arange(4), 4).tolist()
+    assert np.array_equal(data.part_game[part], row_game[entry_row])
+
+
+def test_subset(db):
+    """Subsets should keep the participants of the selected games."""
+    data = GameData.from_games(Game.select().order_by(Game.swid))
+    sub = data.subset([3, 1])
+    assert sub.id.tolist() == [data.id[3], data.id[1]]
+    assert sub.part_game.tolist() == [0, 0, 0, 0, 1, 1, 1, 1]
+    assert np.array_equal(sub.part_actor[4:],
+            data.part_actor[data.part_game == 1])
+    mask = data.subset(data.is_neutral)
+    assert mask.id.tolist() == [data.id[1]]
+
+
+def test_snapshot(db, tmp_path):
+    """Snapshots should give back the columns loaded from the database."""
+    data = GameData.from_games(Game.select().order_by(Game.swid))
+    saved = snapshot(str(tmp_path), Game.select().order_by(Game.swid))
+    loaded = GameData.load(str(tmp_path))
+    for name, _ in GameData.GAME_COLUMNS:
+        assert np.array_equal(getattr(loaded, name), getattr(data, name),
+                equal_nan=(name.startswith("score")))
+    for name, _ in GameData.PART_COLUMNS:
+        assert np.array_equal(getattr(loaded, "part_" + name),
+                getattr(data, "part_" + name))
+    # Missing names are `None` in both cases.
+    assert loaded.team_away_name.tolist() == ["B", None, "A", None]
+    assert sorted(loaded.actor_ids.tolist()) == sorted(
+            saved.actor_ids.tolist())
+    assert len(saved.actor_ids) == 6
+
+
+def test_features(db):
+    """Missing team names should be features like any other."""
+    data = GameData.from_games(Game.select().order_by(Game.swid))
+    feats = Features()
+    for name in data.team_home_name.tolist() + data.team_away_name.tolist():
+        feats.add(name, group="teams")
+    assert len(feats) == 3
+    idx = feats.get_indices(data.team_away_name)
+    assert idx.tolist() == [feats.get_idx(name)
+            for name in data.team_away_name]
+    assert feats.get_indices(np.array([], dtype=object)).tolist() == []
+    # Later entries overwrite earlier ones.
+    mat = feats.build_matrix([0, 1, 0], [idx[0], idx[1], idx[0]],
+            [1.0, -1.0, 2.0], 3)
+    assert mat.shape == (3, 3)
+    expected = np.zeros((3, 3))
+    expected[0, idx[0]] = 2.0
+    expected[1, idx[1]] = -1.0
+    assert np.array_equal(mat.toarray(), expected)
+
+
+def _old_losses(outcomes, probs):
+    # Losses computed as by the previous, loop-based implementation.
+    zero_one, log_loss = 0, 0.0
+    for outcome, pred in zip(outcomes, probs):
+        if np.argmax(pred) != outcome:
+            zero_one += 1
+        if pred[outcome] <= 0:
+            return zero_one, float("inf")
+        log_loss += -math.log(pred[outcome])
+    return zero_one, log_loss
+
+
+def test_results_metrics():
+    """Metrics should match their loop-based definitions."""
+    probs = RND.dirichlet(np.ones(3), size=50)
+    outcomes = RND.randint(3, size=50)
+    res = TestResults(np.arange(50), outcomes, probs)
+    zero_one, log_loss = _old_losses(outcomes, probs)
+    assert res.zero_one_loss == zero_one
+    assert np.isclose(res.log_loss, log_loss)
+    brier = sum(np.sum((pred - np.eye(3)[outcome])**2)
+            for outcome, pred in zip(outcomes, probs))
+    assert np.isclose(res.brier_score, brier)
+    # A zero probability for the observed outcome gives an infinite loss.
+    probs[7, outcomes[7]] = 0.0
+    assert TestResults(np.arange(50), outcomes, probs).log_loss == math.inf
+
+
+def test_results_calibration():
+    """Calibration bins should count probabilities and outcomes."""
+    probs = [[0.9, 0.05, 0.05], [0.6, 0.3, 0.1], [0.2, 0.3, 0.5]]
+    res = TestResults(np.arange(3), [0, 2, 2], probs)
+    mean_pred, freq, counts = res.calibration(n_bins=2)
+    assert counts.tolist() == [6, 3]
+    assert np.allclose(mean_pred, [1.0 / 6, 2.0 / 3])
+    assert np.allclose(freq, [1.0 / 6, 2.0 / 3])
+    mean_pred, freq, counts = res.calibration(n_bins=20)
+    assert counts.sum() == 9
+    assert np.all(np.isnan(freq[counts == 0]))
+
+
+def _predictor(game):
+    # Picklable predictor, which does not query the database.
+    return (0.5, 0.3, 0.2) if game.swid % 2 == 0 else (0.1, 0.2, 0.7)
+
+
+def test_evaluate_fct(db):
+    """Predictors should give the same results with or without a pool."""
+    test_set = TestSet(list(Game.select()
+            .where(Game.score_home_ft.is_null(False))
+            .order_by(Game.swid)))
+    res = test_set.evaluate_fct(_predictor)
+    outcomes = [Outcome.win, Outcome.tie, Outcome.loss]
+    assert res.outcomes.tolist() == [outcomes.index(test_set._outcome(game))
+            for game in test_set.games]
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        threads = test_set.evaluate_fct(_predictor, executor=executor)
+    DB_PROXY.close()
+    procs = test_set.evaluate_fct(_predictor, processes=2, chunksize=2)
+    for other in (threads, procs):
+        assert np.array_equal(other.probs, res.probs)
+        assert np.array_equal(other.outcomes, res.outcomes)
+
+
+def _index_names(database):
+    return {index.name for table in database.get_tables()
+            for index in database.get_indexes(table)}
+
+
+def test_optimized_db():
+    """Optimized connections should get the composite indexes."""
+    init_db("sqlite:///:memory:", optimize=True)
+    DB_PROXY.create_tables([Team, Actor, Game, Participant], safe=True)
+    create_indexes(DB_PROXY)
+    names = _index_names(DB_PROXY)
+    assert "participant_game_id_team_id" in names
+    assert "game_team_home_id_kickoff_time" in names
+    assert load_records(Team, [{"swid": 0, "name": "A"}, {"swid": 1}]) == 2
+    assert Team.select().count() == 2
+    DB_PROXY.close()
+
+
+def test_ingest_main(tmp_path, capsys):
+    """The command-line interface should create tables and load feeds."""
+    teams = tmp_path / "teams.csv"
+    teams.write_text("swid,name\n0,A\n1,\n")
+    games = tmp_path / "games.jsonl"
+    games.write_text('{"swid": 0, "team_home_swid": 0, "team_away_swid": 1, '
+            '"score_home_ft": 1, "score_away_ft": 0, '
+            '"kickoff_time": "2010-01-01 18:00:00"}\n')
+    url = "sqlite:///{}".format(tmp_path / "games.db")
+    ingest.main([url, "--create-tables", "team:{}".format(teams),
+            "game:{}".format(games)])
+    assert "2 rows written to team" in capsys.readouterr().out
+    assert Game.get().team_home.name == "A"
+    assert Team.get(Team.swid == 1).name is None
+    names = _index_names(DB_PROXY)
+    assert "participant_actor_id_game_id" in names
+    assert "odds_game_id_platform" in names
+    DB_PROXY.close()
+
+
+def test_predictions(db):
+    """Rewriting predictions should keep one row per game and model."""
+    DB_PROXY.create_tables([Prediction], safe=True)
+    games = list(Game.select().order_by(Game.swid))
+    ids = sorted(game.id for game in games)
+    probs = RND.dirichlet(np.ones(3), size=len(games))
+    assert write_predictions("m1", games, probs) == len(games)
+    write_predictions("m2", ids, 1 - probs)
+    # Overwrite the predictions of two games, from a `TestResults`.
+    data = GameData.from_games(games).subset([2, 0])
+    res = TestResults(data.id, data.outcomes(), probs[[0, 2]])
+    assert write_predictions("m1", res) == 2
+    assert Prediction.select().count() == 2 * len(games)
+    for model in ("m1", "m2"):
+        for gid in ids:
+            assert (Prediction.select()
+                    .where((Prediction.model == model)
+                            & (Prediction.game == gid))
+                    .count()) == 1
+    expected = probs.copy()
+    expected[[2, 0]] = probs[[0, 2]]
+    rids, rprobs = read_predictions("m1")
+    assert rids.tolist() == [game.id for game in games]
+    assert np.allclose(rprobs, expected)
+    rids, rprobs = read_predictions("m2", games=Game.select().where(
+            Game.swid >= 2))
+    assert rids.tolist() == [game.id for game in games[2:]]
+    assert np.allclose(rprobs, 1 - probs[2:])
+    rids, rprobs = read_predictions("m1", games=data)
+    assert rids.tolist() == sorted(data.id.tolist())
+    assert read_predictions("m3")[1].shape == (0, 3)
+
+
+def _laplace_gp(kern, alpha, n_iter=100):
+    # Laplace approximation in function space (Rasmussen & Williams,
+    # Algorithm 3.1), with the likelihood `sigmoid(f - alpha)` for each row.
+    f = np.zeros(len(kern))
+    for _ in range(n_iter):
+        probs = expit(f - alpha)
+        sqw = np.sqrt(probs * (1 - probs))
+        factor = cho_factor(np.eye(len(f)) + sqw[:, None] * kern * sqw)
+        b = sqw**2 * f + (1 - probs)
+        a = b - sqw * cho_solve(factor, sqw * kern.dot(b))
+        f = kern.dot(a)
+    probs = expit(f - alpha)
+    sqw = np.sqrt(probs * (1 - probs))
+    factor = cho_factor(np.eye(len(f)) + sqw[:, None] * kern * sqw)
+    return 1 - probs, sqw, factor
+
+
+def test_weight_space_posterior():
+    """Weight-space and function-space Laplace fits should agree."""
+    featmat = sparse_random(30, 8, density=0.3, format="csr",
+            random_state=RND, data_rvs=RND.randn)
+    # Feature 5 never appears.
+    featmat = featmat.multiply(np.arange(8) != 5).tocsr()
+    featmat.eliminate_zeros()
+    prior_var = RND.uniform(0.5, 2.0, size=8)
+    post = WeightSpacePosterior(featmat, prior_var, 0.3, new_var=1.5)
+    # Test rows, with an extra feature added after fitting.
+    test = sparse_random(10, 9, density=0.4, format="csr",
+            random_state=RND, data_rvs=RND.randn)
+    mean, var = post.latent(test)
+    dense, new = featmat.toarray(), test.toarray()
+    prior = np.append(prior_var, 1.5)
+    kern = (dense * prior_var).dot(dense.T)
+    cross = (dense * prior_var).dot(new[:, :8].T)
+    grad, sqw, factor = _laplace_gp(kern, 0.3)
+    vec = sqw[:, None] * cross
+    assert np.allclose(mean, cross.T.dot(grad))
+    assert np.allclose(var, np.sum(new**2 * prior, axis=1)
+            - np.sum(vec * cho_solve(factor, vec), axis=0))
+    # Predictions average the likelihood over the latent value.
+    probs = post.predict(test)
+    assert np.all((probs > 0) & (probs < 1))
+    assert np.allclose(post.predict(test[:, :8] * 0), expit(-0.3))
+
+
+def _old_featmat(model, games):
+    # Design matrix built game by game, as the models used to.
+    rows = list()
+    for game in games:
+        for sign in (+1.0, -1.0):
+            if sign * (game.score_home_ft - game.score_away_ft) < 0:
+                continue
+            vec = model.features.new_vector()
+            if isinstance(model, TeamGPModel):
+                vec[game.team_home.name] = +sign
+                vec[game.team_away.name] = -sign
+            else:
+                for p in game.participants:
+                    if p.ratio == 0:
+                        continue
+                    elif p.team_id == game.team_home_id:
+                        vec[p.actor_id] = +sign * p.ratio
+                    else:
+                        vec[p.actor_id] = -sign * p.ratio
+            if not game.is_neutral:
+                vec["home_adv"] = +sign
+            rows.append(vec.as_array())
+    return np.array(rows)
+
+
+@pytest.mark.parametrize("cls", [ActorGPModel, TeamGPModel])
+def test_featmat(db, cls):
+    """Design matrices should match the game-by-game construction."""
+    games = list(Game.select().order_by(Game.swid))
+    model = cls(0.5)
+    model._prepare(GameData.from_games(games))
+    # Draws give two rows, games without a score none.
+    assert model.featmat.shape == (4, len(model.features))
+    played = [game for game in games if game.score_home_ft is not None]
+    assert np.array_equal(model.featmat.toarray(),
+            _old_featmat(model, played))
+
+
+@pytest.mark.parametrize("cls", [ActorGPModel, TeamGPModel])
+def test_fit_weights(db, cls):
+    """Models should be fitted without GPy by the weights backend."""
+    model = cls(0.5, home_advantage=True)
+    diag = model.fit(Game.select(), backend="weights")
+    assert diag.info["backend"] == "weights"
+    assert model.gp is None and model.posterior is not None
+    probs = model.predict_many(Game.select().order_by(Game.swid))
+    assert probs.shape == (4, 3)
+    assert np.allclose(probs.sum(axis=1), 1.0)
+    assert np.all(probs > 0)
+
+
+@pytest.mark.parametrize("cls", [ActorGPModel, TeamGPModel])
+def test_predict_many(db, cls):
+    """Batched predictions should match game-by-game predictions."""
+    model = cls(0.5)
+    model.fit(Game.select().where(Game.swid < 2), backend="weights")
+    games = list(Game.select().order_by(Game.swid))
+    expected = np.array([model.predict(game) for game in games])
+    assert np.allclose(model.predict_many(games), expected)
+
+
+def test_dense_inputs():
+    """Dense inputs should preserve the covariances of linear kernels."""
+    train = sparse_random(20, 12, density=0.3, format="csr",
+            random_state=RND, data_rvs=RND.randn)
+    # Features 7 to 9 never appear in the training inputs.
+    train = train.multiply((np.arange(12) < 7) | (np.arange(12) > 9)).tocsr()
+    train.eliminate_zeros()
+    groups = [np.arange(10), np.array([10, 11])]
+    inputs = _DenseInputs(train, groups)
+    # Test inputs have two more features, in the first group.
+    test = sparse_random(5, 14, density=0.5, format="csr",
+            random_state=RND, data_rvs=RND.randn)
+    variances = [0.7, 2.0]
+    def cov(a, b, dims):
+        return sum(var * a[:, idx].dot(b[:, idx].T)
+                for var, idx in zip(variances, dims))
+    full = [np.append(groups[0], [12, 13]), groups[1]]
+    dtrain = np.hstack((train.toarray(), np.zeros((20, 2))))
+    dtest = test.toarray()
+    xtrain, xtest = inputs.transform(train), inputs.transform(test)
+    dims = inputs.active_dims
+    assert xtrain.shape[1] < train.shape[1]
+    assert np.allclose(cov(xtrain, xtrain, dims), cov(dtrain, dtrain, full))
+    assert np.allclose(cov(xtest, xtrain, dims), cov(dtest, dtrain, full))
+    # Only the prior variances of the test inputs are preserved.
+    assert np.allclose(np.diag(cov(xtest, xtest, dims)),
+            np.diag(cov(dtest, dtest, full)))
+
+
+@pytest.mark.parametrize("cls", [ActorGPModel, TeamGPModel])
+def test_update(league, cls):
+    """Updating a model should be the same as fitting it on all the games."""
+    data = GameData.from_games(Game.select().order_by(Game.swid))
+    first = data.subset(np.arange(20))
+    model = cls(0.5)
+    model.fit(first, backend="weights")
+    model.update(data.subset(np.arange(20, 40)), backend="weights")
+    full = cls(0.5)
+    full.fit(data, backend="weights")
+    assert model.featmat.shape == full.featmat.shape
+    assert np.allclose(model.predict_many(data), full.predict_many(data),
+            atol=1e-6)
+    # Updating a model that has not been fitted is the same as fitting it.
+    fresh = cls(0.5)
+    fresh.update(data, backend="weights")
+    assert np.allclose(fresh.predict_many(data), full.predict_many(data))
+
+
+class _RecordingModel(TeamGPModel):
+
+    """Model recording the kickoff times of its training games."""
+
+    def fit(self, games, **kwargs):
+        self.trained = list(games.kickoff_time)
+        return super().fit(games, **kwargs)
+
+    def update(self, games, **kwargs):
+        self.trained.extend(games.kickoff_time)
+        return super().update(games, **kwargs)
+
+    def predict_many(self, games):
+        self.windows.append((games.kickoff_time.min(), max(self.trained)))
+        return super().predict_many(games)
+
+
+def test_backtest(league):
+    """Windows should only be predicted by models trained on past games."""
+    model = _RecordingModel(0.5)
+    model.windows = list()
+    start = START + datetime.timedelta(days=10)
+    res = backtest(model, Game.select(), start, START
+            + datetime.timedelta(days=50), backend="weights")
+    # Games without a score are not predicted.
+    assert len(res) == 28 and len(model.windows) == 4
+    for first, last_trained in model.windows:
+        assert last_trained < first
+    assert res.probs.shape == (28, 3)
+    assert np.isfinite(res.log_loss)
+
+
+class _ConstantModel(PredictiveModel):
+
+    """Model predicting the same probabilities for every game."""
+
+    def __init__(self, alpha, home_advantage=True, fail_save=False,
+            **hyperparams):
+        self.alpha = alpha
+        self.home_advantage = home_advantage
+        self.hyperparams = hyperparams
+        self.fail_save = fail_save
+        self.n_fits = 0
+
+    def fit(self, games, **kwargs):
+        self.n_fits += 1
+
+    def predict(self, game):
+        return (0.5, 0.2, 0.3)
+
+    def save(self, path):
+        if self.fail_save:
+            raise IOError("disk full")
+        super().save(path)
+
+
+def test_cache_key(db, tmp_path):
+    """Keys should change with the model, the games and the actors."""
+    cache = ModelCache(str(tmp_path))
+    games = GameData.from_games(Game.select())
+    key = cache.key(_ConstantModel(0.5), games)
+    assert cache.key(_ConstantModel(0.5), games) == key
+    others = [
+        cache.key(_ConstantModel(0.4), games),
+        cache.key(_ConstantModel(0.5, home_advantage=False), games),
+        cache.key(_ConstantModel(0.5, actors_var=2.0), games),
+        cache.key(_ConstantModel(0.5), games, backend="weights"),
+        cache.key(_ConstantModel(0.5), games.subset([0, 1])),
+    ]
+    load_records(Actor, [{"swid": 99}])
+    others.append(cache.key(_ConstantModel(0.5), games))
+    assert len(set(others + [key])) == len(others) + 1
+
+
+def test_cache_new_actor(db, tmp_path):
+    """Models should be refitted when actors are added to the database."""
+    cache = ModelCache(str(tmp_path))
+    train = Game.select().where(Game.swid < 2)
+    cache.fit(ActorGPModel(0.5), train, backend="weights")
+    load_records(Actor, [{"swid": 99}])
+    load_records(Participant, [{"game_swid": 3, "team_swid": 0,
+            "actor_swid": 99, "is_coach": False, "is_starter": True,
+            "ratio": 1.0}])
+    model = cache.fit(ActorGPModel(0.5), train, backend="weights")
+    assert len(cache) == 2
+    probs = model.predict_many(Game.select().where(Game.swid == 3))
+    assert np.allclose(probs.sum(axis=1), 1.0)
+
+
+def test_cache_hits(db, tmp_path):
+    """Cached models should be loaded instead of being fitted again."""
+    cache = ModelCache(str(tmp_path))
+    model = cache.fit(_ConstantModel(0.5), Game.select())
+    assert model.n_fits == 1
+    again = cache.fit(_ConstantModel(0.5), Game.select())
+    assert again.n_fits == 1 and again is not model
+    assert len(cache) == 1
+    assert cache.key(again, Game.select()) in cache
+
+
+def test_cache_eviction(db, tmp_path):
+    """Least recently used entries should be evicted first."""
+    cache = ModelCache(str(tmp_path), max_entries=2)
+    keys = list()
+    for k, alpha in enumerate((0.1, 0.2)):
+        model = cache.fit(_ConstantModel(alpha), Game.select())
+        keys.append(cache.key(model, Game.select()))
+        path = os.path.join(str(tmp_path), keys[-1] + ".pkl")
+        os.utime(path, (1000 + k, 1000 + k))
+    # Using the first entry makes the second one the least recently used.
+    cache.fit(_ConstantModel(0.1), Game.select())
+    cache.fit(_ConstantModel(0.3), Game.select())
+    assert len(cache) == 2
+    assert keys[0] in cache and keys[1] not in cache
+    # With a size limit of one entry, only the last one is kept.
+    size = os.path.getsize(os.path.join(str(tmp_path), keys[0] + ".pkl"))
+    cache = ModelCache(str(tmp_path), max_size=size + 10)
+    model = cache.fit(_ConstantModel(0.4), Game.select())
+    assert len(cache) == 1 and cache.key(model, Game.select()) in cache
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_cache_atomic(db, tmp_path):
+    """Failed writes should leave neither an entry nor a temporary file."""
+    cache = ModelCache(str(tmp_path))
+    with pytest.raises(IOError):
+        cache.fit(_ConstantModel(0.5, fail_save=True), Game.select())
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_grid_search(league):
+    """Grid search should match fits and evaluations point by point."""
+    data = GameData.from_games(Game.select().order_by(Game.swid))
+    train = data.subset(np.arange(25))
+    test_set = TestSet.from_games(data.subset(np.arange(25, 40)))
+    grid = {"alpha": [0.3, 0.6], "teams_var": [0.5, 2.0]}
+    table = grid_search(TeamGPModel(0.5), train, test_set, grid,
+            processes=1, backend="weights")
+    assert len(table) == 4
+    parallel = grid_search(TeamGPModel(0.5), train, test_set, grid,
+            processes=2, backend="weights")
+    assert np.array_equal(parallel, table)
+    for row in table:
+        model = TeamGPModel(row["alpha"], teams_var=row["teams_var"])
+        model.fit(train, backend="weights")
+        model.extend_features(test_set.games)
+        res = test_set.evaluate(model)
+        assert np.isclose(row["log_loss"], res.log_loss)
+        assert row["zero_one_loss"] == res.zero_one_loss
@@ -1,8 +1,13 @@
 import math
 import numpy as np
+import pytest
 
-from thesis.thurstone import _Functions
+from thesis.diagnostics import FitDiagnostics
+from thesis.thurstone import (
+        IncrementalThurstone, _Functions, _SparseFunctions, thurstone_mle,
+        thurstone_mle_batch)
 from scipy.optimize import check_grad, approx_fprime
+from scipy.sparse import csr_matrix
 
 
 RND = np.random.RandomState(42)
@@ -28,3 +33,182 @@ def test_gradient():
         val = approx_fprime(xs, fcts.objective, EPS)
         err = check_grad(fcts.objective, fcts.gradient, xs, epsilon=EPS)
         assert abs(err / np.linalg.norm(val)) < 1e-5
+
+
+def test_sparse_functions():
+    """Sparse objective and gradient should match the dense ones."""
+    winners, losers = np.nonzero(MAT)
+    fcts = _Functions(MAT, 0.2)
+    sfcts = _SparseFunctions(winners, losers, MAT[winners, losers], 0.2)
+    for sigma in np.linspace(1, 5, num=5):
+        xs = sigma * RND.randn(len(MAT))
+        assert np.isclose(sfcts.objective(xs), fcts.objective(xs))
+        assert np.allclose(sfcts.gradient(xs), fcts.gradient(xs))
+
+
+def test_mle_sparse_inputs():
+    """Sparse matrices and edge lists should give the same estimates."""
+    dense = thurstone_mle(MAT, penalty=0.1)
+    sparse = thurstone_mle(csr_matrix(MAT), penalty=0.1)
+    assert np.allclose(sparse, dense, atol=1e-4)
+    # Repeated (winner, loser) pairs are summed.
+    winners, losers = np.nonzero(MAT)
+    counts = MAT[winners, losers]
+    edges = thurstone_mle(
+            (np.repeat(winners, counts), np.repeat(losers, counts)),
+            penalty=0.1)
+    assert np.allclose(edges, dense, atol=1e-4)
+
+
+def test_fused():
+    """Fused evaluation should match the objective and stay finite."""
+    winners, losers = np.nonzero(MAT)
+    for fcts in (_Functions(MAT, 0.2),
+            _SparseFunctions(winners, losers, MAT[winners, losers], 0.2)):
+        xs = 3 * RND.randn(len(MAT))
+        obj, grad = fcts.fused(xs)
+        assert np.isclose(obj, fcts.objective(xs))
+        err = check_grad(fcts.objective, fcts.gradient, xs, epsilon=EPS)
+        assert abs(err / np.linalg.norm(grad)) < 1e-5
+        # Extreme differences should not produce NaNs or infinities.
+        obj, grad = fcts.fused(100 * xs)
+        assert np.isfinite(obj) and np.all(np.isfinite(grad))
+
+
+def test_hessp():
+    """Hessian-vector products should match finite differences."""
+    winners, losers = np.nonzero(MAT)
+    for fcts in (_Functions(MAT, 0.2),
+            _SparseFunctions(winners, losers, MAT[winners, losers], 0.2)):
+        xs = 2 * RND.randn(len(MAT))
+        vec = RND.randn(len(MAT))
+        approx = (fcts.gradient(xs + EPS * vec)
+                - fcts.gradient(xs - EPS * vec)) / (2 * EPS)
+        assert np.allclose(fcts.hessp(xs, vec), approx, atol=1e-6)
+
+
+def test_mle_methods():
+    """Second-order solvers should converge to the BFGS estimate."""
+    expected = thurstone_mle(MAT, penalty=0.1)
+    for method in ("Newton-CG", "trust-ncg"):
+        for data in (MAT, csr_matrix(MAT)):
+            params = thurstone_mle(data, penalty=0.1, method=method)
+            assert np.allclose(params, expected, atol=1e-4)
+
+
+def test_mle_batch():
+    """Batched fits should match individual fits."""
+    mats = np.array([MAT, MAT.T, MAT + MAT.T])
+    expected = np.array([thurstone_mle(mat, penalty=0.1) for mat in mats])
+    assert np.allclose(
+            thurstone_mle_batch(mats, processes=1, penalty=0.1), expected)
+    params = thurstone_mle_batch(
+            [csr_matrix(mat) for mat in mats], processes=2, penalty=0.1)
+    assert params.shape == (3, len(MAT))
+    assert np.allclose(params, expected, atol=1e-4)
+
+
+def test_incremental():
+    """Incremental refits should match a fit on all the data seen so far."""
+    winners, losers = np.nonzero(MAT)
+    counts = MAT[winners, losers]
+    model = IncrementalThurstone(penalty=0.1, tol=1e-8)
+    # First batch: only the comparisons among the first five items.
+    first = (winners < 5) & (losers < 5)
+    model.update(winners[first], losers[first], counts[first])
+    sub = thurstone_mle(MAT[:5,:5], penalty=0.1)
+    assert np.allclose(model.fit(), sub, atol=1e-4)
+    # Second batch: the rest, which brings in new items.
+    model.update(winners[~first], losers[~first], counts[~first])
+    assert model.n_items == len(MAT)
+    assert len(model) == len(winners)
+    assert np.allclose(
+            model.fit(), thurstone_mle(MAT, penalty=0.1), atol=1e-4)
+    # Repeated comparisons are added to the existing counts.
+    model.update(winners, losers, counts)
+    assert len(model) == len(winners)
+    assert np.allclose(
+            model.fit(), thurstone_mle(2 * MAT, penalty=0.1), atol=1e-4)
+
+
+def test_hessian():
+    """Dense and sparse Hessians should be consistent with `hessp`."""
+    winners, losers = np.nonzero(MAT)
+    for fcts in (_Functions(MAT, 0.2),
+            _SparseFunctions(winners, losers, MAT[winners, losers], 0.2)):
+        xs = 2 * RND.randn(len(MAT))
+        vec = RND.randn(len(MAT))
+        assert np.allclose(fcts.hessian(xs).dot(vec), fcts.hessp(xs, vec))
+
+
+def test_laplace_variances():
+    """Laplace variances should be the diagonal of the inverse Hessian."""
+    params, var = thurstone_mle(MAT, penalty=0.1, return_var="exact")
+    hess = _Functions(MAT, 0.1).hessian(params)
+    assert np.allclose(var, np.diag(np.linalg.inv(hess)))
+    _, svar = thurstone_mle(csr_matrix(MAT), penalty=0.1, return_var="exact")
+    assert np.allclose(svar, var, rtol=1e-3)
+    _, dvar = thurstone_mle(MAT, penalty=0.1, return_var="diagonal")
+    assert np.allclose(dvar, var, rtol=0.5)
+    # Without a penalty, the variance of the mean is infinite.
+    with pytest.raises(ValueError):
+        thurstone_mle(csr_matrix(MAT), penalty=0, return_var="diagonal")
+
+
+def test_laplace_variances_approx():
+    """Approximate variances should be close to the exact ones."""
+    n = 200
+    rng = np.random.RandomState(0)
+    winners = rng.randint(n, size=3000)
+    losers = (winners + rng.randint(1, n, size=3000)) % n
+    data = (winners, losers)
+    for penalty in (1e-6, 0.1):
+        _, var = thurstone_mle(data, penalty=penalty, n_items=n,
+                return_var="exact")
+        _, svar = thurstone_mle(data, penalty=penalty, n_items=n,
+                return_var="stochastic")
+        assert np.median(np.abs(svar - var) / var) < 0.05
+        assert np.allclose(svar, var, rtol=0.25)
+        _, dvar = thurstone_mle(data, penalty=penalty, n_items=n,
+                return_var="diagonal")
+        assert np.allclose(dvar, var, rtol=0.5)
+
+
+def test_diagnostics():
+    """Diagnostics should record the iterations of the optimizer."""
+    for method in ("BFGS", "Newton-CG", "trust-ncg"):
+        diag = FitDiagnostics()
+        records = list()
+        params, _ = thurstone_mle(MAT, penalty=0.1, method=method,
+                return_var="diagonal", diagnostics=diag,
+                callback=lambda params, rec: records.append(rec))
+        assert np.allclose(params, thurstone_mle(MAT, penalty=0.1),
+                atol=1e-4)
+        assert records == diag.iterations
+        assert len(diag.iterations) == diag.info["n_iter"] > 0
+        assert diag.info["success"]
+        fcts = _Functions(MAT, 0.1)
+        assert np.isclose(diag.iterations[-1]["objective"],
+                fcts.objective(params))
+        # Objectives decrease, times increase.
+        objs = [rec["objective"] for rec in diag.iterations]
+        times = [rec["time"] for rec in diag.iterations]
+        assert np.all(np.diff(objs) <= 1e-12)
+        assert np.all(np.diff(times) >= 0)
+        assert set(diag.phases) == {"optimize", "variances"}
+        summary = diag.summary()
+        assert summary["n_iterations"] == len(diag.iterations)
+        assert "time_optimize" in summary
+        assert diag.to_dict()["iterations"] == diag.iterations
+
+
+def test_default_method():
+    """Sparse data should use a solver with a linear memory footprint."""
+    winners, losers = np.nonzero(MAT)
+    for data, method in ((MAT, "BFGS"), (csr_matrix(MAT), "Newton-CG"),
+            ((winners, losers, MAT[winners, losers]), "Newton-CG")):
+        diag = FitDiagnostics()
+        params = thurstone_mle(data, penalty=0.1, diagnostics=diag)
+        assert diag.info["method"] == method
+        assert np.allclose(params, thurstone_mle(MAT, penalty=0.1),
+                atol=1e-4)
@@ -1,2 +1,13 @@
-from .thurstone import thurstone_mle
-from .util import setup_plotting
+from ._lazy import attach
+
+# Submodules are imported on first use of their names, see `_lazy`.
+__getattr__, __dir__, __all__ = attach(__name__, {
+    "comparisons": ["ComparisonCounts", "read_comparisons"],
+    "diagnostics": ["FitDiagnostics"],
+    "thurstone": [
+        "IncrementalThurstone",
+        "thurstone_mle",
+        "thurstone_mle_batch",
+    ],
+    "util": ["setup_plotting"],
+})
@@ -0,0 +1,36 @@
+"""Lazy loading of the public names of a package.
+
+Packages declare which submodule defines each of their public names. A
+submodule is imported the first time one of its names is accessed, so that
+importing a package does not import the (heavy) dependencies of all its
+submodules, such as matplotlib, `scipy.optimize` or GPy.
+"""
+import importlib
+
+
+def attach(package, submodules):
+    """Return `__getattr__`, `__dir__` and `__all__` for a package.
+
+    `package` is the name of the package, and `submodules` maps the names of
+    its submodules to the lists of public names they define. A public name
+    should not be the name of a submodule, which would shadow it once the
+    submodule is imported.
+    """
+    origin = {name: module
+            for module, names in submodules.items() for name in names}
+
+    def __getattr__(name):
+        if name not in origin:
+            raise AttributeError("module {!r} has no attribute {!r}"
+                    .format(package, name))
+        module = importlib.import_module("." + origin[name], package)
+        val = getattr(module, name)
+        # Later accesses do not go through `__getattr__`.
+        setattr(importlib.import_module(package), name, val)
+        return val
+
+    def __dir__():
+        names = set(vars(importlib.import_module(package)))
+        return sorted(names | set(origin))
+
+    return __getattr__, __dir__, list(origin)
@@ -1,5 +1,16 @@
-from .utils import (
-    displacement,
-    qtod,
-    weighted_quantiles,
-)
+from .._lazy import attach
+
+__getattr__, __dir__, __all__ = attach(__name__, {
+    "metrics": [
+        "displacement",
+        "kendall_tau",
+        "spearman_rho",
+        "top_k_overlap",
+    ],
+    "utils": [
+        "qtod",
+        "ranks",
+        "weighted_quantiles",
+        "WeightedQuantileSketch",
+    ],
+})
@@ -0,0 +1,86 @@
+"""Metrics comparing two rankings.
+
+Every metric takes two arrays of scores, which are converted to rankings with
+`ranks` (ties are broken at random). Each row of a 2-D array is a separate
+ranking, and a 1-D array is broadcast against the rows of a 2-D one, so that,
+e.g., many estimates can be compared to the ground truth in one call.
+"""
+import numpy as np
+
+from .utils import ranks
+
+
+def _rank_pairs(vals1, vals2, rng):
+    # Returns two 2-D arrays of ranks, and whether the inputs were 1-D.
+    rng = np.random.default_rng(rng)
+    vals1, vals2 = np.asarray(vals1), np.asarray(vals2)
+    scalar = vals1.ndim == 1 and vals2.ndim == 1
+    ranks1, ranks2 = np.broadcast_arrays(
+            np.atleast_2d(ranks(vals1, rng=rng)),
+            np.atleast_2d(ranks(vals2, rng=rng)))
+    return ranks1, ranks2, scalar
+
+
+def _result(vals, scalar):
+    return vals[0] if scalar else vals
+
+
+def _count_inversions(seqs):
+    """Count the inversions in each row of a 2-D array of distinct integers.
+
+    This is a bottom-up merge sort, vectorized across rows and across the
+    runs of each pass. Merging two sorted runs is a stable sort, which
+    NumPy's timsort performs in linear time, and the number of elements of
+    the left run larger than each element of the right run is read off from
+    the merged positions. The total cost is O(n log n) per row.
+    """
+    batch, n = seqs.shape
+    size = 1 << max(n - 1, 0).bit_length()
+    # Pad with increasing values larger than all others: no new inversions.
+    seqs = np.concatenate((seqs.astype(np.int64), np.broadcast_to(
+            np.arange(n, size), (batch, size - n))), axis=1)
+    total = np.zeros(batch, dtype=np.int64)
+    width = 1
+    while width < size:
+        runs = seqs.reshape(batch, -1, 2 * width)
+        order = np.argsort(runs, axis=-1, kind="stable")
+        # An element at index `j` of the right run, merged at position `k`,
+        # is preceded by `k - j` elements of the left run; the remaining
+        # `width - (k - j)` elements of the left run are inversions.
+        pos = np.arange(2 * width)
+        larger = width - (pos - (order - width))
+        total += np.where(order >= width, larger, 0).sum(axis=(1, 2))
+        seqs = np.take_along_axis(runs, order, axis=-1).reshape(batch, size)
+        width *= 2
+    return total
+
+
+def displacement(vals1, vals2, rng=None):
+    """Compute the rank displacement."""
+    ranks1, ranks2, scalar = _rank_pairs(vals1, vals2, rng)
+    return _result(np.abs(ranks1 - ranks2).sum(axis=1), scalar)
+
+
+def kendall_tau(vals1, vals2, rng=None):
+    """Compute Kendall's tau rank correlation coefficient."""
+    ranks1, ranks2, scalar = _rank_pairs(vals1, vals2, rng)
+    n = ranks1.shape[1]
+    # Order the second ranking by the first; discordant pairs are inversions.
+    seqs = np.take_along_axis(ranks2, np.argsort(ranks1, axis=1), axis=1)
+    discordant = _count_inversions(seqs - 1)
+    return _result(1.0 - 4.0 * discordant / (n * (n - 1)), scalar)
+
+
+def spearman_rho(vals1, vals2, rng=None):
+    """Compute Spearman's rank correlation coefficient."""
+    ranks1, ranks2, scalar = _rank_pairs(vals1, vals2, rng)
+    n = ranks1.shape[1]
+    sqdiffs = np.square(ranks1 - ranks2, dtype=float).sum(axis=1)
+    return _result(1.0 - 6.0 * sqdiffs / (n * (n**2 - 1)), scalar)
+
+
+def top_k_overlap(vals1, vals2, k, rng=None):
+    """Compute the fraction of the top-`k` items common to both rankings."""
+    ranks1, ranks2, scalar = _rank_pairs(vals1, vals2, rng)
+    common = np.count_nonzero((ranks1 <= k) & (ranks2 <= k), axis=1)
+    return _result(common / k, scalar)
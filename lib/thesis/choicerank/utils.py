@@ -1,51 +1,154 @@
 import numpy as np
-import random
-import sys
-
-
-def ranks(vals):
-    """Compute the rank of each item."""
-    items = list(range(len(vals)))
-    random.shuffle(items)  # Randomizes things in case of ties.
-    ordered = sorted(items, key=lambda x: vals[x], reverse=True)
-    ranks = np.zeros(len(vals), dtype=int)
-    for rank, item in enumerate(ordered, start=1):
-        ranks[item] = rank
-    return ranks
 
-    
-def displacement(vals1, vals2):
-    """Compute the rank displacement."""
-    ranks1 = ranks(vals1)
-    ranks2 = ranks(vals2)
-    total = 0
-    for i, j in zip(ranks1, ranks2):
-        total += abs(i - j)
-    return total
+
+def ranks(vals, rng=None):
+    """Compute the rank of each item.
+
+    The item with the largest value gets rank 1, and ties are broken at
+    random. If `vals` is a 2-D array, each row is ranked separately. `rng` is
+    a seed or a `numpy.random.Generator`.
+    """
+    rng = np.random.default_rng(rng)
+    vals = np.asarray(vals)
+    # Sort by increasing value, then by a random key in case of ties, and
+    # rank from the end (negating the values breaks unsigned and boolean
+    # arrays).
+    order = np.lexsort((rng.random(vals.shape), vals), axis=-1)
+    ranks = np.empty(vals.shape, dtype=int)
+    np.put_along_axis(ranks, order, np.broadcast_to(
+            np.arange(vals.shape[-1], 0, -1), vals.shape), axis=-1)
+    return ranks
 
 
-def weighted_quantiles(data, weights, fractions=[0.5]):
+def weighted_quantiles(data, weights, fractions=[0.5], axis=None):
     """Calculate weighted quantiles.
 
     Basically, this function uses a trick that avoids duplicating the same
-    measurements multiple times.
+    measurements multiple times: the quantile at fraction `f` is the largest
+    value whose cumulative weight is at most `f` times the total weight. If
+    `axis` is given, quantiles are computed along that axis, and the first
+    dimension of the result indexes the fractions (as in `np.quantile`).
     """
+    fractions = np.asarray(fractions, dtype=float)
+    data = np.asarray(data)
+    weights = np.broadcast_to(weights, data.shape)
+    if axis is None:
+        data, weights = data.ravel(), weights.ravel()
+        axis = 0
+    data = np.moveaxis(data, axis, -1)
+    shape, n = data.shape[:-1], data.shape[-1]
+    data = data.reshape(-1, n)
+    weights = np.moveaxis(weights, axis, -1).reshape(-1, n)
     # Preprocessing (mostly sorting), takes the most time.
-    data, weights = np.array(data).flatten(), np.array(weights).flatten()
-    ind = np.argsort(data)
-    sdata = np.array(data[ind])
-    sweights = np.array(weights[ind])
-    cum_weight = np.cumsum(sweights)
-    # Actual work.
-    quantiles = list()
-    for fraction in fractions:
-        point = fraction * np.sum(weights)
-        below_idx = np.where(cum_weight <= point)[0][-1]
-        if cum_weight[below_idx] - point < sys.float_info.epsilon:
-            quantiles.append(sdata[below_idx])
-            continue
-        quantiles.append(sdata[below_idx+1])
-    return np.array(quantiles)
+    ind = np.argsort(data, axis=1)
+    sdata = np.take_along_axis(data, ind, axis=1)
+    cum_weight = np.cumsum(np.take_along_axis(weights, ind, axis=1), axis=1)
+    # Actual work: one `searchsorted` for all rows and fractions. Cumulative
+    # weights are normalized to [0, 1] and shifted by twice the row index,
+    # so that the flattened array is sorted.
+    if len(sdata) == 1:
+        idx = np.searchsorted(
+                cum_weight[0], fractions * cum_weight[0,-1], side="right")
+        idx = idx[np.newaxis,:]
+    else:
+        offsets = 2.0 * np.arange(len(sdata))[:,np.newaxis]
+        cum_weight = cum_weight / cum_weight[:,-1:] + offsets
+        idx = np.searchsorted(cum_weight.ravel(),
+                (fractions[np.newaxis,:] + offsets).ravel(), side="right")
+        idx = idx.reshape(len(sdata), -1) - n * np.arange(len(sdata))[:,None]
+    # Index of the last point below each fraction (or the first point).
+    idx = np.maximum(idx - 1, 0)
+    quantiles = np.take_along_axis(sdata, idx, axis=1)
+    return np.moveaxis(quantiles, 1, 0).reshape(fractions.shape + shape)
+
+
+class WeightedQuantileSketch:
+
+    """Mergeable, bounded-memory sketch for weighted quantiles.
+
+    Points are stored in a hierarchy of levels. When a level holds more than
+    `2 * size` points, it is compacted: the points are sorted and grouped
+    into (at most) `size` consecutive bins of roughly equal weight, and each
+    bin is replaced by its largest value, carrying the total weight of the
+    bin, at the next level. Sketches of different parts of the data (e.g.,
+    built in different processes) can be combined with `merge`.
+
+    Error bound: for every value `x`, the weight of the sketched points less
+    than or equal to `x` is at most that of the data, and at least that minus
+    `self.error`. Indeed, a compaction only moves weight upwards, within a
+    bin, and a single bin straddles `x`. `self.error` sums, over compactions,
+    the largest weight moved within a bin. For `n` points of unit weight, it
+    grows roughly as `n * log2(n / size) / size`. `quantiles` applies
+    `weighted_quantiles` to the sketched points, so its results agree with
+    those on the full data up to fractions of about
+    `self.error / total_weight`.
+    """
+
+    def __init__(self, size=1000):
+        self.size = size
+        self.error = 0.0
+        self._levels = list()
+
+    def __len__(self):
+        return sum(len(vals) for vals, _ in self._levels)
+
+    @property
+    def total_weight(self):
+        return sum(np.sum(weights) for _, weights in self._levels)
+
+    def update(self, values, weights=None):
+        """Add a batch of (weighted) values to the sketch."""
+        values = np.asarray(values, dtype=float).ravel()
+        if weights is None:
+            weights = np.ones(len(values))
+        weights = np.broadcast_to(weights, values.shape).astype(float)
+        self._push(0, values, weights)
+        self._compact()
+        return self
+
+    def merge(self, other):
+        """Merge another sketch (of the same size) into this one."""
+        assert self.size == other.size, "sketches should have the same size"
+        for level, (values, weights) in enumerate(other._levels):
+            self._push(level, values, weights)
+        self.error += other.error
+        self._compact()
+        return self
+
+    def quantiles(self, fractions=[0.5]):
+        """Calculate (approximate) weighted quantiles."""
+        values = np.concatenate([vals for vals, _ in self._levels])
+        weights = np.concatenate([ws for _, ws in self._levels])
+        return weighted_quantiles(values, weights, fractions)
+
+    def _push(self, level, values, weights):
+        if level == len(self._levels):
+            self._levels.append((values, weights))
+        else:
+            vals, ws = self._levels[level]
+            self._levels[level] = (
+                    np.concatenate((vals, values)),
+                    np.concatenate((ws, weights)))
+
+    def _compact(self):
+        level = 0
+        while level < len(self._levels):
+            values, weights = self._levels[level]
+            if len(values) > 2 * self.size:
+                ind = np.argsort(values)
+                values, weights = values[ind], weights[ind]
+                cum_weight = np.cumsum(weights)
+                # Bins are determined by where each point starts.
+                bins = np.floor(
+                        (cum_weight - weights) * self.size / cum_weight[-1])
+                ends = np.append(np.flatnonzero(np.diff(bins)), len(bins) - 1)
+                starts = np.insert(ends[:-1] + 1, 0, 0)
+                binweights = np.add.reduceat(weights, starts)
+                moved = binweights - weights[ends]
+                self.error += max(np.max(moved), 0.0)
+                self._levels[level] = (values[:0], weights[:0])
+                self._push(level + 1, values[ends], binweights)
+            level += 1
 
 
 def qtod(quantiles):
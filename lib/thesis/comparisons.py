@@ -0,0 +1,184 @@
+"""Out-of-core ingestion of pairwise-comparison logs.
+
+Comparison logs are read in chunks of (winner, loser) events, item IDs are
+mapped to contiguous indices, and events are aggregated into win counts. Peak
+memory depends on the chunk size and on the number of distinct pairs, not on
+the size of the raw log.
+"""
+import csv
+import itertools
+import numpy as np
+import zipfile
+
+from scipy.sparse import coo_matrix
+
+
+class ItemIndex:
+
+    """Mapping from arbitrary item IDs to contiguous integer indices."""
+
+    def __init__(self):
+        self._idx = dict()
+        self.ids = list()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, item_id):
+        return self._idx[item_id]
+
+    def index(self, ids):
+        """Return the indices of an array of IDs, adding unknown ones."""
+        uniques, inv = np.unique(ids, return_inverse=True)
+        idx = np.empty(len(uniques), dtype=int)
+        for k, item_id in enumerate(uniques.tolist()):
+            if item_id not in self._idx:
+                self._idx[item_id] = len(self.ids)
+                self.ids.append(item_id)
+            idx[k] = self._idx[item_id]
+        return idx[inv.ravel()]
+
+
+class ComparisonCounts:
+
+    """Win counts aggregated from chunks of (winner, loser) events.
+
+    Distinct pairs are stored as sorted 64-bit keys with their counts.
+    Aggregates of new chunks are buffered and merged into the main arrays
+    only once the buffer is as large as them, which keeps the total merging
+    cost quasi-linear in the number of events.
+    """
+
+    def __init__(self):
+        self.items = ItemIndex()
+        self._keys = np.zeros(0, dtype=np.int64)
+        self._counts = np.zeros(0, dtype=float)
+        self._buffer = list()
+        self._buffered = 0
+
+    def __len__(self):
+        """Number of distinct (winner, loser) pairs."""
+        self._consolidate()
+        return len(self._keys)
+
+    @property
+    def n_items(self):
+        return len(self.items)
+
+    def add(self, winners, losers, counts=None):
+        """Add a chunk of comparisons, given as arrays of item IDs."""
+        winners = self.items.index(winners)
+        losers = self.items.index(losers)
+        keys = (winners.astype(np.int64) << 32) | losers
+        keys, inv = np.unique(keys, return_inverse=True)
+        self._buffer.append(
+                (keys, np.bincount(inv.ravel(), weights=counts)))
+        self._buffered += len(keys)
+        if self._buffered >= max(len(self._keys), 1):
+            self._consolidate()
+
+    def edges(self):
+        """Return the aggregated data as `(winners, losers, counts)`.
+
+        The tuple can be passed directly to `thurstone_mle` (with `n_items`
+        set to `self.n_items`).
+        """
+        self._consolidate()
+        winners = (self._keys >> 32).astype(int)
+        losers = (self._keys & 0xFFFFFFFF).astype(int)
+        return winners, losers, self._counts.copy()
+
+    def to_sparse(self):
+        """Return the aggregated data as a sparse matrix of win counts."""
+        winners, losers, counts = self.edges()
+        shape = (self.n_items, self.n_items)
+        return coo_matrix((counts, (winners, losers)), shape=shape).tocsr()
+
+    def _consolidate(self):
+        if not self._buffer:
+            return
+        keys = np.concatenate([self._keys] + [k for k, _ in self._buffer])
+        counts = np.concatenate(
+                [self._counts] + [c for _, c in self._buffer])
+        self._keys, inv = np.unique(keys, return_inverse=True)
+        self._counts = np.bincount(inv.ravel(), weights=counts)
+        self._buffer = list()
+        self._buffered = 0
+
+
+def read_csv_chunks(path, chunksize=1000000, columns=(0, 1), delimiter=",",
+        skip_header=False, dtype=None):
+    """Read (winner, loser) ID pairs from a CSV file, chunk by chunk.
+
+    `columns` gives the positions of the winner and loser columns. Yields
+    pairs of arrays of (at most) `chunksize` IDs.
+    """
+    wcol, lcol = columns
+    with open(path, newline="") as f:
+        reader = csv.reader(f, delimiter=delimiter)
+        if skip_header:
+            next(reader, None)
+        while True:
+            rows = list(itertools.islice(reader, chunksize))
+            if not rows:
+                return
+            yield (np.array([row[wcol] for row in rows], dtype=dtype),
+                   np.array([row[lcol] for row in rows], dtype=dtype))
+
+
+def read_npy_chunks(path, chunksize=1000000):
+    """Read (winner, loser) ID pairs from a NumPy file, chunk by chunk.
+
+    `.npy` files should contain an array with two columns (winners, losers)
+    and are memory-mapped. `.npz` archives should contain two 1-D arrays
+    named `winners` and `losers`; they are decompressed incrementally.
+    """
+    if path.endswith(".npz"):
+        with zipfile.ZipFile(path) as archive:
+            with archive.open("winners.npy") as fw, \
+                    archive.open("losers.npy") as fl:
+                yield from zip(
+                        _stream_npy(fw, chunksize),
+                        _stream_npy(fl, chunksize))
+        return
+    data = np.load(path, mmap_mode="r")
+    assert data.ndim == 2 and data.shape[1] == 2, (
+        "data should have two columns (winners, losers)")
+    for start in range(0, len(data), chunksize):
+        chunk = np.array(data[start:start+chunksize])
+        yield chunk[:,0], chunk[:,1]
+
+
+def _stream_npy(f, chunksize):
+    # Reads a 1-D array in `.npy` format from a file object, chunk by chunk.
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+    assert len(shape) == 1, "arrays should be one-dimensional"
+    remaining = shape[0]
+    while remaining > 0:
+        size = min(chunksize, remaining)
+        buf = f.read(size * dtype.itemsize)
+        yield np.frombuffer(buf, dtype=dtype)
+        remaining -= size
+
+
+def read_comparisons(paths, chunksize=1000000, **kwargs):
+    """Aggregate comparison logs into a `ComparisonCounts` instance.
+
+    `paths` is a path or a list of paths to CSV, `.npy` or `.npz` files.
+    Additional keyword arguments are passed to `read_csv_chunks`.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    counts = ComparisonCounts()
+    for path in paths:
+        if path.endswith((".npy", ".npz")):
+            chunks = read_npy_chunks(path, chunksize)
+        else:
+            chunks = read_csv_chunks(path, chunksize, **kwargs)
+        for winners, losers in chunks:
+            counts.add(winners, losers)
+    return counts
@@ -0,0 +1,74 @@
+"""Diagnostics of model fits: convergence, iterations and timings.
+
+Fitting functions fill a `FitDiagnostics` instance, which can be exported to
+JSON (`to_dict`, `to_json`) or to a flat dict of scalar metrics (`summary`),
+e.g., to monitor fits in production and to set time budgets.
+"""
+import contextlib
+import json
+import time
+
+
+class FitDiagnostics:
+
+    """Record of a fit.
+
+    - `iterations` lists the iterations of the optimizer, as dicts with the
+      value of the objective, the norm of its gradient and the wall time
+      (in seconds since the creation of the instance).
+    - `phases` maps the phases of the fit (e.g., building features,
+      inference) to their wall time in seconds.
+    - `info` holds other information, such as the convergence status or the
+      number of function evaluations.
+    """
+
+    def __init__(self):
+        self.iterations = list()
+        self.phases = dict()
+        self.info = dict()
+        self._start = time.perf_counter()
+
+    def record_iteration(self, objective, grad_norm):
+        """Record an iteration of the optimizer, return the record."""
+        record = {
+            "iteration": len(self.iterations) + 1,
+            "objective": float(objective),
+            "grad_norm": float(grad_norm),
+            "time": time.perf_counter() - self._start,
+        }
+        self.iterations.append(record)
+        return record
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time a phase of the fit; times of repeated phases are summed."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = (self.phases.get(name, 0.0)
+                    + time.perf_counter() - start)
+
+    @property
+    def total_time(self):
+        return sum(self.phases.values())
+
+    def to_dict(self):
+        return {
+            "info": dict(self.info),
+            "phases": dict(self.phases),
+            "total_time": self.total_time,
+            "iterations": [dict(record) for record in self.iterations],
+        }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def summary(self):
+        """Flat dict of scalar metrics, e.g., for a metrics pipeline."""
+        metrics = dict(self.info)
+        for name, secs in self.phases.items():
+            metrics["time_" + name] = secs
+        metrics["total_time"] = self.total_time
+        metrics["n_iterations"] = len(self.iterations)
+        return metrics
@@ -1,24 +1,45 @@
-from .predictive_models import (
-    ActorGPModel,
-    TeamGPModel,
-)
+from .._lazy import attach
 
-from .data_models import (
-    init_db,
-    Team,
-    Actor,
-    Game,
-    Participant,
-    Odds,
-    Prediction,
-    Contribution,
-    CurrentClub,
-)
-
-from .utils import (
-    Outcome,
-    TestSet,
-    TestResults,
-    Features,
-    FeatureVector,
-)
+# GPy is only imported with the models, peewee with the data models.
+__getattr__, __dir__, __all__ = attach(__name__, {
+    "predictive_models": [
+        "ActorGPModel",
+        "TeamGPModel",
+    ],
+    "data_models": [
+        "init_db",
+        "create_indexes",
+        "Team",
+        "Actor",
+        "Game",
+        "Participant",
+        "Odds",
+        "Prediction",
+        "Contribution",
+        "CurrentClub",
+    ],
+    "gamedata": [
+        "GameData",
+        "snapshot",
+    ],
+    "walkforward": [
+        "backtest",
+    ],
+    "cache": [
+        "ModelCache",
+    ],
+    "predictions": [
+        "read_predictions",
+        "write_predictions",
+    ],
+    "tuning": [
+        "grid_search",
+    ],
+    "utils": [
+        "Outcome",
+        "TestSet",
+        "TestResults",
+        "Features",
+        "FeatureVector",
+    ],
+})
@@ -0,0 +1,129 @@
+"""Content-addressed, on-disk cache of fitted models.
+
+A fitted model is stored under a hash of its class, its hyperparameters, the
+arguments passed to `fit`, the training data (games, scores and
+participants) and the actors of the database (one feature each in
+`ActorGPModel`). Fitting the same model on the same data again loads the saved
+model instead of running inference.
+"""
+import hashlib
+import numpy as np
+import os
+import tempfile
+
+from .data_models import Actor
+from .gamedata import as_game_data
+
+
+# Part of every key: bump it when the saved state of the models changes.
+CACHE_VERSION = 1
+
+
+class ModelCache:
+
+    """Directory of fitted models, with least-recently-used eviction.
+
+    Entries are evicted (least recently used first) as soon as the directory
+    holds more than `max_entries` models or more than `max_size` bytes.
+    """
+
+    def __init__(self, directory, max_size=None, max_entries=None):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_entries = max_entries
+        os.makedirs(directory, exist_ok=True)
+
+    def __len__(self):
+        return len(self._entries())
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def key(self, model, games, **kwargs):
+        """Key of `model` fitted on `games` with `kwargs`."""
+        data = as_game_data(games)
+        h = hashlib.sha256()
+        cls = type(model)
+        params = {
+            "alpha": model.alpha,
+            "home_advantage": model.home_advantage,
+        }
+        params.update(model.hyperparams)
+        for part in (CACHE_VERSION, cls.__module__, cls.__qualname__,
+                sorted(params.items()), sorted(kwargs.items())):
+            h.update(repr(part).encode())
+        for name, _ in data.GAME_COLUMNS:
+            h.update(_digest(getattr(data, name)))
+        for name, _ in data.PART_COLUMNS:
+            h.update(_digest(getattr(data, "part_" + name)))
+        # All the actors, from the snapshot if available.
+        actor_ids = data.actor_ids
+        if actor_ids is None:
+            actor_ids = np.array(
+                    [aid for aid, in Actor.select(Actor.id).tuples()],
+                    dtype=int)
+        h.update(_digest(np.sort(actor_ids)))
+        return h.hexdigest()
+
+    def fit(self, model, games, **kwargs):
+        """Fit `model` on `games`, or load it if it is in the cache.
+
+        `kwargs` are passed to `model.fit`. Returns the fitted model, which
+        is a new instance if it was loaded from the cache.
+        """
+        data = as_game_data(games)
+        key = self.key(model, data, **kwargs)
+        path = self._path(key)
+        if os.path.exists(path):
+            # Mark the entry as recently used.
+            os.utime(path)
+            return type(model).load(path)
+        model.fit(data, **kwargs)
+        # Write to a temporary file first, so that concurrent readers never
+        # see a partial entry.
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            model.save(tmp)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self._evict()
+        return model
+
+    def clear(self):
+        """Remove all the entries."""
+        for path, _, _ in self._entries():
+            os.remove(path)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".pkl")
+
+    def _entries(self):
+        # Path, last use and size of each entry, least recently used first.
+        entries = list()
+        for name in os.listdir(self.directory):
+            if name.endswith(".pkl"):
+                path = os.path.join(self.directory, name)
+                stat = os.stat(path)
+                entries.append((path, stat.st_mtime, stat.st_size))
+        return sorted(entries, key=lambda entry: entry[1])
+
+    def _evict(self):
+        entries = self._entries()
+        total = sum(size for _, _, size in entries)
+        while entries and (
+                (self.max_entries is not None
+                        and len(entries) > self.max_entries)
+                or (self.max_size is not None and total > self.max_size)):
+            path, _, size = entries.pop(0)
+            os.remove(path)
+            total -= size
+
+
+def _digest(arr):
+    # Bytes identifying the contents of a column.
+    if arr.dtype == object:
+        return repr(arr.tolist()).encode()
+    return np.ascontiguousarray(arr).tobytes()
@@ -6,10 +6,54 @@ from playhouse.db_url import connect
 
 DB_PROXY = Proxy()
 
-
-def init_db(db_url):
-    database = connect(db_url)
+# Pragmas applied to each SQLite connection by `init_db(..., optimize=True)`:
+# write-ahead logging (readers don't block the writer), fewer fsyncs, 64 MB
+# of page cache and 256 MB of memory-mapped I/O.
+SQLITE_PRAGMAS = (
+    ("journal_mode", "wal"),
+    ("synchronous", "normal"),
+    ("cache_size", -64000),
+    ("mmap_size", 2**28),
+    ("temp_store", "memory"),
+)
+
+
+def init_db(db_url, optimize=False):
+    """Connect the models to the database at `db_url`.
+
+    With `optimize`, SQLite databases are opened with `SQLITE_PRAGMAS`, and
+    the composite indexes of `create_indexes` are added if they are missing.
+    """
+    if optimize and db_url.startswith("sqlite"):
+        database = connect(db_url, pragmas=SQLITE_PRAGMAS)
+    else:
+        database = connect(db_url)
     DB_PROXY.initialize(database)
+    if optimize:
+        create_indexes(database)
+
+
+def create_indexes(database):
+    """Create the composite indexes of `INDEXES`, for existing tables."""
+    tables = set(database.get_tables())
+    for model, names in INDEXES:
+        table = _name(model._meta, "table_name", "db_table")
+        if table not in tables:
+            continue
+        columns = [_name(model._meta.fields[name], "column_name", "db_column")
+                for name in names]
+        name = "_".join([table] + columns)
+        database.execute_sql("CREATE INDEX IF NOT EXISTS {} ON {} ({})"
+                .format(name, table, ", ".join(columns)))
+
+
+def _name(obj, *attrs):
+    # Peewee 3 renamed `db_table` and `db_column` to `table_name` and
+    # `column_name`: returns the first attribute that exists.
+    for attr in attrs:
+        if hasattr(obj, attr):
+            return getattr(obj, attr)
+    raise AttributeError(attrs[0])
 
 
 class BaseModel(Model):
@@ -141,3 +185,16 @@ class CurrentClub(BaseModel):
     actor = ForeignKeyField(Actor, related_name="current_club")
     team = ForeignKeyField(Team, null=True)
     squad_number = IntegerField(null=True)
+
+
+# Composite indexes for common access paths: participants of a game (by
+# team), appearances of an actor over time, games of a team over time, and
+# odds and predictions of a game.
+INDEXES = (
+    (Participant, ("game", "team")),
+    (Participant, ("actor", "game")),
+    (Game, ("team_home", "kickoff_time")),
+    (Game, ("team_away", "kickoff_time")),
+    (Odds, ("game", "platform")),
+    (Prediction, ("game", "model")),
+)
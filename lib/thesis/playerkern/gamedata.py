@@ -0,0 +1,243 @@
+import numpy as np
+import os
+
+from .data_models import Actor, Game, Participant, Team
+
+from peewee import JOIN, SelectQuery
+
+
+# Maximum number of IDs per `IN (...)` clause (SQLite limits the number of
+# variables in a query).
+CHUNK_SIZE = 500
+
+# Maximum number of variables in a statement (SQLite's default limit), which
+# bounds the number of rows per multi-row insert.
+MAX_VARIABLES = 999
+
+
+class GameData:
+
+    """Columnar representation of games, their teams and participants.
+
+    The columns are loaded in a constant number of queries (per chunk of
+    games), instead of the queries issued lazily by `game.participants`,
+    `game.team_home`, etc. Game columns are indexed by the position of the
+    game; `part_game` gives the position of the game of each participant.
+
+    The columns can be saved to disk with `save` (e.g., as a snapshot of the
+    database, see `snapshot`), and memory-mapped with `load`: processes that
+    load the same snapshot share its pages, and never access the database.
+    """
+
+    # Column names and types. Missing values are mapped to -1 (IDs), NaN
+    # (scores, e.g., for upcoming games), `False` and `NaT`.
+    GAME_COLUMNS = (
+        ("id", int),
+        ("team_home", int),
+        ("team_away", int),
+        ("team_home_name", object),
+        ("team_away_name", object),
+        ("score_home_ft", float),
+        ("score_away_ft", float),
+        ("is_neutral", bool),
+        ("kickoff_time", "datetime64[s]"),
+    )
+    PART_COLUMNS = (
+        ("game", int),
+        ("team", int),
+        ("actor", int),
+        ("ratio", float),
+        ("is_starter", bool),
+    )
+    # Optional columns, listing all the actors of the database. They are
+    # only set by `snapshot`; models then use them instead of querying the
+    # database.
+    TABLE_COLUMNS = (
+        ("actor_ids", int),
+    )
+
+    def __init__(self, games, participants, tables=None):
+        # `games`, `participants` and `tables` map column names to arrays.
+        tables = tables or dict()
+        for name, _ in self.GAME_COLUMNS:
+            setattr(self, name, games[name])
+        for name, _ in self.PART_COLUMNS:
+            setattr(self, "part_" + name, participants[name])
+        for name, _ in self.TABLE_COLUMNS:
+            setattr(self, name, tables.get(name))
+
+    def __len__(self):
+        return len(self.id)
+
+    @classmethod
+    def from_games(cls, games):
+        """Load the data of `games`, a query or a list of `Game` instances."""
+        if isinstance(games, SelectQuery):
+            # Use the query as a subquery: two queries in total.
+            chunks = [games.select(Game.id)]
+            ids = [gid for gid, in games.select(Game.id).tuples()]
+        else:
+            ids = [game.id for game in games]
+            chunks = [ids[i:i+CHUNK_SIZE]
+                    for i in range(0, len(ids), CHUNK_SIZE)]
+        home, away = Team.alias(), Team.alias()
+        game_rows, part_rows = list(), list()
+        for chunk in chunks:
+            game_rows.extend(Game
+                    .select(Game.id, Game.team_home, Game.team_away,
+                            home.name, away.name, Game.score_home_ft,
+                            Game.score_away_ft, Game.is_neutral,
+                            Game.kickoff_time)
+                    .join(home, JOIN.LEFT_OUTER,
+                            on=(Game.team_home == home.id))
+                    .switch(Game)
+                    .join(away, JOIN.LEFT_OUTER,
+                            on=(Game.team_away == away.id))
+                    .where(Game.id << chunk)
+                    .tuples())
+            part_rows.extend(Participant
+                    .select(Participant.game, Participant.team,
+                            Participant.actor, Participant.ratio,
+                            Participant.is_starter)
+                    .where(Participant.game << chunk)
+                    .tuples())
+        # Restore the order of the games given as input.
+        pos = {gid: i for i, gid in enumerate(ids)}
+        game_rows.sort(key=lambda row: pos[row[0]])
+        part_rows = [(pos[row[0]],) + row[1:] for row in part_rows]
+        return cls(_columns(game_rows, cls.GAME_COLUMNS),
+                _columns(part_rows, cls.PART_COLUMNS))
+
+    def subset(self, idx):
+        """Return the games selected by `idx`, a boolean mask or indices."""
+        idx = np.arange(len(self))[idx]
+        games = {name: getattr(self, name)[idx]
+                for name, _ in self.GAME_COLUMNS}
+        # Map positions of the selected games to their new positions.
+        newpos = np.full(len(self), -1)
+        newpos[idx] = np.arange(len(idx))
+        keep = np.flatnonzero(newpos[self.part_game] >= 0)
+        keep = keep[np.argsort(newpos[self.part_game[keep]], kind="stable")]
+        parts = {name: getattr(self, "part_" + name)[keep]
+                for name, _ in self.PART_COLUMNS}
+        parts["game"] = newpos[parts["game"]]
+        return GameData(games, parts, self._tables())
+
+    def outcomes(self):
+        """Outcome of each game: 0 (home win), 1 (draw) or 2 (away win).
+
+        Raises `ValueError` if a game has no score (e.g., it is upcoming).
+        """
+        if np.any(np.isnan(self.score_home_ft) | np.isnan(self.score_away_ft)):
+            raise ValueError("games without a score have no outcome")
+        return np.select(
+                [self.score_home_ft > self.score_away_ft,
+                 self.score_home_ft == self.score_away_ft],
+                [0, 1], default=2)
+
+    def save(self, path):
+        """Save the columns to the directory `path`, one `.npy` file each.
+
+        Text columns are saved as fixed-width strings, missing values as
+        empty strings; `load` maps them back to `None`, as `from_games`.
+        """
+        os.makedirs(path, exist_ok=True)
+        columns = dict(self._tables())
+        columns.update((name, getattr(self, name))
+                for name, _ in self.GAME_COLUMNS)
+        columns.update(("part_" + name, getattr(self, "part_" + name))
+                for name, _ in self.PART_COLUMNS)
+        for name, col in columns.items():
+            if col.dtype == object:
+                col = np.array(["" if x is None else x for x in col],
+                        dtype=str)
+            np.save(os.path.join(path, name + ".npy"), col)
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        """Load columns saved with `save`, memory-mapped by default.
+
+        Text columns (which are small) are loaded in memory, as objects.
+        """
+        def load_column(name):
+            col = np.load(os.path.join(path, name + ".npy"),
+                    mmap_mode=mmap_mode)
+            if col.dtype.kind == "U":
+                col = np.array([x or None for x in col.tolist()], dtype=object)
+            return col
+        games = {name: load_column(name) for name, _ in cls.GAME_COLUMNS}
+        parts = {name: load_column("part_" + name)
+                for name, _ in cls.PART_COLUMNS}
+        tables = {name: load_column(name) for name, _ in cls.TABLE_COLUMNS
+                if os.path.exists(os.path.join(path, name + ".npy"))}
+        return cls(games, parts, tables)
+
+    def _tables(self):
+        return {name: getattr(self, name) for name, _ in self.TABLE_COLUMNS
+                if getattr(self, name) is not None}
+
+    def n_participants(self):
+        """Number of participants of each game."""
+        return np.bincount(self.part_game, minlength=len(self))
+
+    def outcome_rows(self):
+        """Rows of a design matrix for the outcomes of the games.
+
+        A win of the home team gives a row with sign +1, a win of the away
+        team a row with sign -1, and a draw gives both. Games without a
+        score give no row. Returns the game and the sign of each row.
+        """
+        signs = np.stack((
+                np.where(self.score_home_ft >= self.score_away_ft, 1.0, 0.0),
+                np.where(self.score_home_ft <= self.score_away_ft, -1.0, 0.0)),
+                axis=1)
+        row_game, col = np.nonzero(signs)
+        return row_game, signs[row_game, col]
+
+    def expand(self, row_game):
+        """Pair each row with each participant of the row's game.
+
+        Returns the row and the participant of each pair, sorted by row.
+        """
+        order = np.argsort(self.part_game, kind="stable")
+        starts = np.searchsorted(self.part_game[order], row_game)
+        counts = self.n_participants()[row_game]
+        entry_row = np.repeat(np.arange(len(row_game)), counts)
+        offsets = np.arange(len(entry_row)) - np.repeat(
+                np.cumsum(counts) - counts, counts)
+        return entry_row, order[np.repeat(starts, counts) + offsets]
+
+
+def snapshot(path, games=None):
+    """Save a columnar snapshot of the database to the directory `path`.
+
+    The snapshot contains `games` (by default, all the games), their
+    participants, and the list of all the actors. Returns the `GameData`
+    instance that was saved; use `GameData.load` to read it.
+    """
+    data = as_game_data(Game.select() if games is None else games)
+    data.actor_ids = np.array(
+            [aid for aid, in Actor.select(Actor.id).tuples()], dtype=int)
+    data.save(path)
+    return data
+
+
+def as_game_data(games):
+    """Return `games` as a `GameData` instance, loading it if necessary."""
+    if isinstance(games, GameData):
+        return games
+    return GameData.from_games(games)
+
+
+_MISSING = {int: -1, float: np.nan, bool: False}
+
+
+def _columns(rows, spec):
+    # Transposes a list of tuples into a dict of typed arrays.
+    columns = dict()
+    for k, (name, dtype) in enumerate(spec):
+        missing = _MISSING.get(dtype)
+        columns[name] = np.array(
+                [missing if row[k] is None else row[k] for row in rows],
+                dtype=dtype)
+    return columns
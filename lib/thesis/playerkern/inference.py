@@ -0,0 +1,112 @@
+"""Weight-space inference for models with linear kernels.
+
+With a linear kernel, the latent function is `f(x) = x^T w`, where the
+weights have a Gaussian prior `w ~ N(0, diag(prior_var))`. Instead of working
+with the n-by-n covariance matrix of the games (as `GPy.core.GP` does),
+inference can be carried out on the d-by-d posterior precision of the
+weights, in time O(nnz + d^3) instead of O(n^3).
+"""
+import numpy as np
+
+from scipy.linalg import cho_factor, cho_solve
+from scipy.sparse import diags
+from scipy.special import expit
+
+
+# Nodes and weights of the Gauss-Hermite quadrature, used to average the
+# likelihood over the Gaussian predictive distribution of the latent value.
+_GH_NODES, _GH_WEIGHTS = np.polynomial.hermite_e.hermegauss(32)
+_GH_WEIGHTS = _GH_WEIGHTS / np.sum(_GH_WEIGHTS)
+
+
+class WeightSpacePosterior:
+
+    """Laplace approximation to the posterior over the weights.
+
+    Each row `x` of `featmat` is an observation with likelihood
+    `sigmoid(x^T w - alpha)`, i.e., the Rao-Kupper link used by the GP
+    models. Features with a zero prior variance are ignored. Features that
+    never appear in the data keep their prior, and are only accounted for
+    in the predictive variance; so are features added after fitting (i.e.,
+    extra columns in the matrices passed to `predict`), whose prior variance
+    is `new_var`. `init` is a vector of weights (indexed by feature) from
+    which Newton's method is started, e.g., the weights of a previous fit.
+    If `diagnostics` (a `FitDiagnostics` instance) is given, it records the
+    iterations of Newton's method.
+    """
+
+    def __init__(self, featmat, prior_var, alpha, new_var=0.0, init=None,
+            max_iter=100, tol=1e-8, diagnostics=None):
+        featmat = featmat.tocsc()
+        prior_var = np.asarray(prior_var, dtype=float)
+        observed = np.diff(featmat.indptr) > 0
+        self.alpha = alpha
+        self.new_var = new_var
+        self._prior_var = prior_var
+        self._cols = np.flatnonzero(observed & (prior_var > 0))
+        self._others = np.flatnonzero(~observed & (prior_var > 0))
+        w0 = np.zeros(len(self._cols))
+        if init is not None:
+            known = self._cols < len(init)
+            w0[known] = init[self._cols[known]]
+        self._fit(featmat[:,self._cols].tocsr(), prior_var[self._cols], w0,
+                max_iter, tol, diagnostics)
+
+    def _fit(self, mat, prior_var, w, max_iter, tol, diagnostics):
+        # Newton's method on the negative log-posterior, with backtracking.
+        def objective(w):
+            return (0.5 * np.sum(w**2 / prior_var)
+                    + np.sum(np.logaddexp(0, self.alpha - mat.dot(w))))
+        obj = objective(w)
+        self.n_iter, self.converged = 0, False
+        for _ in range(max_iter):
+            probs = expit(mat.dot(w) - self.alpha)
+            grad = w / prior_var - mat.T.dot(1.0 - probs)
+            prec = (mat.T.dot(diags(probs * (1.0 - probs))).dot(mat)
+                    + diags(1.0 / prior_var)).toarray()
+            step = cho_solve(cho_factor(prec), grad)
+            size = 1.0
+            while objective(w - size * step) > obj and size > 1e-10:
+                size /= 2
+            w -= size * step
+            prev, obj = obj, objective(w)
+            self.n_iter += 1
+            if diagnostics is not None:
+                # Norm of the gradient before the step.
+                diagnostics.record_iteration(obj, np.linalg.norm(grad))
+            if prev - obj < tol * max(1.0, abs(obj)):
+                self.converged = True
+                break
+        # Posterior precision at the mode.
+        probs = expit(mat.dot(w) - self.alpha)
+        prec = (mat.T.dot(diags(probs * (1.0 - probs))).dot(mat)
+                + diags(1.0 / prior_var)).toarray()
+        self.mean = w
+        self._factor = cho_factor(prec)
+
+    def weights(self):
+        """Posterior mean of the weights, indexed by feature."""
+        weights = np.zeros(len(self._prior_var))
+        weights[self._cols] = self.mean
+        return weights
+
+    def latent(self, featmat):
+        """Predictive mean and variance of the latent value of each row."""
+        featmat = featmat.tocsc()
+        obs = featmat[:,self._cols]
+        mean = obs.dot(self.mean)
+        var = np.asarray(obs.multiply(
+                cho_solve(self._factor, obs.T.toarray()).T).sum(axis=1))[:,0]
+        others = featmat[:,self._others]
+        var += others.multiply(others).dot(self._prior_var[self._others])
+        if featmat.shape[1] > len(self._prior_var):
+            new = featmat[:,len(self._prior_var):]
+            var += self.new_var * np.asarray(
+                    new.multiply(new).sum(axis=1))[:,0]
+        return mean, var
+
+    def predict(self, featmat):
+        """Predictive probability of the observation for each row."""
+        mean, var = self.latent(featmat)
+        vals = mean[:,np.newaxis] + np.sqrt(var)[:,np.newaxis] * _GH_NODES
+        return expit(vals - self.alpha).dot(_GH_WEIGHTS)
@@ -0,0 +1,172 @@
+"""Bulk ingestion of CSV and JSON feeds into the playerkern database.
+
+A feed contains records of a single model, whose keys are the names of the
+model's fields. Foreign keys are given by the `swid` of the referenced row,
+under the key `<field>_swid` (e.g., `team_home_swid` or `actor_swid`). Rows
+are written with multi-row inserts, all in one transaction per feed:
+
+- teams, actors and games are upserted on their `swid`: existing rows are
+  replaced, but keep their `id` (hence the rows referencing them stay
+  valid);
+- participants and odds have no natural key: those of the games in the feed
+  are replaced by the rows of the feed.
+
+Usage:
+
+    python -m thesis.playerkern.ingest sqlite:///games.db \\
+            team:teams.csv game:games.json participant:participants.csv
+"""
+import argparse
+import csv
+import json
+
+from .data_models import (
+        init_db, create_indexes, Actor, Game, Odds, Participant, Team,
+        DB_PROXY)
+from .gamedata import CHUNK_SIZE, MAX_VARIABLES
+
+from peewee import BooleanField, DoubleField, ForeignKeyField, IntegerField
+
+
+MODELS = {
+    "team": Team,
+    "actor": Actor,
+    "game": Game,
+    "participant": Participant,
+    "odds": Odds,
+}
+
+_TRUE = ("1", "true", "t", "yes", "y")
+
+
+def read_feed(path):
+    """Read the records of a CSV, JSON or JSON-lines file."""
+    with open(path, newline="") as f:
+        if path.endswith(".csv"):
+            return list(csv.DictReader(f))
+        if path.endswith((".jsonl", ".ndjson")):
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
+
+
+def load_records(model, records):
+    """Write `records` (a list of dicts) to the table of `model`.
+
+    Returns the number of rows written.
+    """
+    rows = _convert(model, records)
+    if not rows:
+        return 0
+    with DB_PROXY.atomic():
+        if "swid" in model._meta.fields:
+            existing = _ids_by_swid(model, [row["swid"] for row in rows])
+            for row in rows:
+                if row["swid"] in existing:
+                    row["id"] = existing[row["swid"]]
+        else:
+            game_ids = sorted(set(row["game"] for row in rows))
+            for i in range(0, len(game_ids), CHUNK_SIZE):
+                (model.delete()
+                        .where(model.game << game_ids[i:i+CHUNK_SIZE])
+                        .execute())
+        # Rows with and without an `id` are inserted separately, so that all
+        # the rows of a statement have the same columns.
+        for group in (
+                [row for row in rows if "id" in row],
+                [row for row in rows if "id" not in row]):
+            if not group:
+                continue
+            size = max(1, MAX_VARIABLES // len(group[0]))
+            for i in range(0, len(group), size):
+                (model.insert_many(group[i:i+size])
+                        .on_conflict("REPLACE")
+                        .execute())
+    return len(rows)
+
+
+def load_feed(model, path):
+    """Write the records of a feed to the table of `model`."""
+    return load_records(model, read_feed(path))
+
+
+def _convert(model, records):
+    # Maps swids of foreign keys to IDs and parses values given as strings.
+    fields = model._meta.fields
+    fks = {name + "_swid": field for name, field in fields.items()
+            if isinstance(field, ForeignKeyField)}
+    ids = dict()
+    for key, field in fks.items():
+        swids = [int(rec[key]) for rec in records
+                if rec.get(key) not in (None, "")]
+        ids[key] = _ids_by_swid(field.rel_model, swids)
+    # All the rows get the same columns, missing values are NULL.
+    keys = set()
+    for rec in records:
+        keys.update(rec)
+    rows = list()
+    for rec in records:
+        row = dict()
+        for key in keys:
+            val = rec.get(key)
+            if key in fks:
+                if val not in (None, ""):
+                    swid = int(val)
+                    assert swid in ids[key], "unknown swid: {}".format(swid)
+                    val = ids[key][swid]
+                else:
+                    val = None
+                row[fks[key].name] = val
+            elif key in fields and key != "id":
+                row[key] = _parse(fields[key], val)
+        rows.append(row)
+    return rows
+
+
+def _parse(field, val):
+    if val == "":
+        return None
+    if not isinstance(val, str):
+        return val
+    if isinstance(field, BooleanField):
+        return val.lower() in _TRUE
+    if isinstance(field, IntegerField):
+        return int(val)
+    if isinstance(field, DoubleField):
+        return float(val)
+    return val
+
+
+def _ids_by_swid(model, swids):
+    # Maps the swids of existing rows to their IDs.
+    swids = sorted(set(swids))
+    ids = dict()
+    for i in range(0, len(swids), CHUNK_SIZE):
+        ids.update(model
+                .select(model.swid, model.id)
+                .where(model.swid << swids[i:i+CHUNK_SIZE])
+                .tuples())
+    return ids
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            description="Load CSV and JSON feeds into the database.")
+    parser.add_argument("db_url", help="database URL, e.g. sqlite:///games.db")
+    parser.add_argument("feeds", nargs="+", metavar="MODEL:PATH",
+            help="feeds, in loading order; MODEL is one of {}".format(
+                ", ".join(MODELS)))
+    parser.add_argument("--create-tables", action="store_true",
+            help="create the tables that do not exist yet")
+    args = parser.parse_args(argv)
+    init_db(args.db_url, optimize=True)
+    if args.create_tables:
+        DB_PROXY.create_tables(list(MODELS.values()), safe=True)
+        create_indexes(DB_PROXY)
+    for feed in args.feeds:
+        name, path = feed.split(":", 1)
+        count = load_feed(MODELS[name], path)
+        print("{}: {} rows written to {}".format(path, count, name))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Bulk storage of predictions in the `Prediction` table.
+
+There is one row per game and model. `probability` is the probability of a
+win of the home team, and `details` holds the probabilities of the three
+outcomes (win, draw, loss) as a JSON list.
+"""
+import datetime
+import json
+import numpy as np
+
+from .data_models import Game, Prediction, DB_PROXY
+from .gamedata import CHUNK_SIZE, MAX_VARIABLES, GameData
+from .utils import TestResults
+
+from peewee import SelectQuery
+
+
+def write_predictions(model, games, probs=None, tstamp=None):
+    """Write the predictions of a model, replacing previous ones.
+
+    `model` is the name of the model. `games` is a `TestResults` instance
+    (`probs` is then taken from it), or the games passed to `predict_many`
+    (a query, a list of games or a `GameData` instance) and `probs` its
+    output. Predictions of `model` for the same games are overwritten. All
+    the rows are written in one transaction. Returns the number of rows.
+    """
+    if isinstance(games, TestResults):
+        games, probs = games.games, games.probs
+    ids = _game_ids(games).tolist()
+    probs = np.asarray(probs, dtype=float).reshape(-1, 3)
+    assert len(ids) == len(probs), "one prediction per game is needed"
+    tstamp = tstamp or datetime.datetime.now()
+    rows = [{
+        "game": gid,
+        "probability": prob[0],
+        "model": model,
+        "tstamp": tstamp,
+        "details": json.dumps(prob),
+    } for gid, prob in zip(ids, probs.tolist())]
+    size = MAX_VARIABLES // 5
+    with DB_PROXY.atomic():
+        for i in range(0, len(ids), CHUNK_SIZE):
+            (Prediction.delete()
+                    .where((Prediction.model == model)
+                            & (Prediction.game << ids[i:i+CHUNK_SIZE]))
+                    .execute())
+        for i in range(0, len(rows), size):
+            Prediction.insert_many(rows[i:i+size]).execute()
+    return len(rows)
+
+
+def read_predictions(model, games=None):
+    """Read the predictions of a model.
+
+    If `games` is given, only predictions for these games are read. Returns
+    the IDs of the games, sorted, and the matrix of the probabilities of the
+    three outcomes (win, draw, loss), one row per game. Predictions without
+    details only have a probability of a win (the others are NaN).
+    """
+    query = (Prediction
+            .select(Prediction.game, Prediction.probability,
+                    Prediction.details)
+            .where(Prediction.model == model))
+    if games is None:
+        rows = list(query.tuples())
+    else:
+        ids = _game_ids(games).tolist()
+        rows = list()
+        for i in range(0, len(ids), CHUNK_SIZE):
+            rows.extend(query
+                    .where(Prediction.game << ids[i:i+CHUNK_SIZE])
+                    .tuples())
+    rows.sort(key=lambda row: row[0])
+    ids = np.array([row[0] for row in rows], dtype=int)
+    probs = np.full((len(rows), 3), np.nan)
+    for k, (_, prob, details) in enumerate(rows):
+        if details is not None:
+            probs[k] = json.loads(details)
+        else:
+            probs[k, 0] = prob
+    return ids, probs
+
+
+def _game_ids(games):
+    # Array of the IDs of games given as a query, instances, or IDs.
+    if isinstance(games, GameData):
+        return np.asarray(games.id)
+    if isinstance(games, SelectQuery):
+        return np.array([gid for gid, in games.select(Game.id).tuples()],
+                dtype=int)
+    games = list(games)
+    if games and isinstance(games[0], Game):
+        return np.array([game.id for game in games], dtype=int)
+    return np.asarray(games, dtype=int)
@@ -1,12 +1,15 @@
 import abc
-import GPy
 import numpy as np
+import pickle
 
+from scipy.sparse import vstack
+
+from ..diagnostics import FitDiagnostics
 from .data_models import Actor, Game, Team
+from .gamedata import as_game_data
+from .inference import WeightSpacePosterior
 from .utils import Features
 
-from GPy.inference.latent_function_inference import expectation_propagation
-
 
 class PredictiveModel(metaclass=abc.ABCMeta):
 
@@ -20,8 +23,244 @@ class PredictiveModel(metaclass=abc.ABCMeta):
     def predict(self, game):
         """Compute outcome probabilities for a game."""
 
+    def predict_many(self, games):
+        """Compute outcome probabilities for many games.
+
+        Returns an array with one row (win, draw, loss) per game. Subclasses
+        can override this to vectorize predictions.
+        """
+        return np.array([self.predict(game) for game in games])
+
+    def save(self, path):
+        """Save the (fitted) model to a file."""
+        with open(path, "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        """Load a model saved with `save`.
+
+        The fitted state (features, design matrix and posterior) is restored
+        as is, without running inference again.
+        """
+        with open(path, "rb") as f:
+            model = pickle.load(f)
+        assert isinstance(model, cls), "unexpected type of model"
+        return model
+
+
+class _DenseInputs:
+
+    """Dense GP inputs, restricted to the features seen during training.
+
+    GPy needs dense inputs, but most features (e.g., actors) never appear in
+    the training games. Under a linear kernel, such a feature only adds to
+    the prior variance of new inputs. For each kernel, these features are
+    therefore replaced by a single column containing the norm of the new
+    input's entries on them (zero for the training inputs). This leaves the
+    covariances with the training inputs and the prior variance of each new
+    input unchanged, hence also the (marginal) predictions. Features added
+    after construction (extra columns of the matrices to transform) are
+    summarized in the same way, as part of the kernel `new_group`.
+    """
+
+    def __init__(self, featmat, groups, new_group=0):
+        # `groups` is a list of arrays of feature indices, one per kernel.
+        self._n_features = featmat.shape[1]
+        self._new_group = new_group
+        used = np.zeros(featmat.shape[1], dtype=bool)
+        used[featmat.indices] = True
+        self._cols = list()  # Features kept, one array per kernel.
+        self._unused = list()  # Features summarized, one array per kernel.
+        self.active_dims = list()
+        offset = sum(np.count_nonzero(used[group]) for group in groups)
+        start = 0
+        for k, group in enumerate(groups):
+            group = np.asarray(group, dtype=int)
+            cols, unused = group[used[group]], group[~used[group]]
+            self._cols.append(cols)
+            self._unused.append(unused)
+            self.active_dims.append(np.append(
+                    np.arange(start, start + len(cols)), offset + k))
+            start += len(cols)
+
+    def transform(self, mat):
+        """Map a sparse matrix of features to dense GP inputs."""
+        dense = mat[:, np.concatenate(self._cols)].toarray()
+        norms = list()
+        for k, unused in enumerate(self._unused):
+            if k == self._new_group:
+                unused = np.append(
+                        unused, np.arange(self._n_features, mat.shape[1]))
+            norms.append(np.sqrt(np.asarray(mat[:, unused].multiply(
+                    mat[:, unused]).sum(axis=1))))
+        return np.hstack([dense] + norms)
+
+
+class _LinearKernelModel(PredictiveModel):
+
+    """Inference shared by models whose kernels are all linear.
+
+    Subclasses build `self.features` in `_build_features`, `self.featmat` in
+    `_build_featmat`, the features of new games in `_predict_featmat`, and
+    set `GROUP`, the group of features with a kernel of variance
+    `<GROUP>_var`.
+    """
+
+    GROUP = None
+
+    def _kernel_groups(self):
+        # Returns the name, feature indices and variance of each kernel.
+        groups = [(self.GROUP, self.features.get_group(self.GROUP),
+                self.hyperparams.get(self.GROUP + "_var", 1.0))]
+        if self.home_advantage:
+            groups.append(("home_adv", [self.features.get_idx("home_adv")],
+                    self.hyperparams.get("home_adv_var", 1.0)))
+        return groups
+
+    def _infer(self, parallel, backend, warm_start=False):
+        # `backend` is either "gp" (EP in function space, using GPy), or
+        # "weights" (Laplace approximation in weight space, whose cost is
+        # cubic in the number of features instead of the number of games).
+        # With `warm_start`, inference starts from the previous solution
+        # (EP site parameters, or weights); rows of `self.featmat` must then
+        # extend the previous ones.
+        assert backend in ("gp", "weights"), "unknown backend"
+        self.diagnostics.info.update(backend=backend,
+                n_rows=self.featmat.shape[0], n_features=len(self.features))
+        with self.diagnostics.phase("inference"):
+            self._infer_backend(parallel, backend, warm_start)
+
+    def _infer_backend(self, parallel, backend, warm_start):
+        groups = self._kernel_groups()
+        if backend == "weights":
+            prior_var = np.zeros(len(self.features))
+            for _, indices, var in groups:
+                prior_var[indices] = var
+            init = None
+            if warm_start and self.posterior is not None:
+                init = self.posterior.weights()
+            self.posterior = WeightSpacePosterior(
+                    self.featmat, prior_var, self.alpha, new_var=groups[0][2],
+                    init=init, diagnostics=self.diagnostics)
+            self.diagnostics.info.update(n_iter=self.posterior.n_iter,
+                    success=self.posterior.converged)
+            self.gp = None
+            return
+        # GPy (a fork of it, with the Rao-Kupper link) is only needed here.
+        import GPy
+        from GPy.inference.latent_function_inference import (
+                expectation_propagation)
+        self.inputs = _DenseInputs(
+                self.featmat, [indices for _, indices, _ in groups])
+        kernel = None
+        for (name, _, var), dims in zip(groups, self.inputs.active_dims):
+            kern = GPy.kern.Linear(input_dim=len(dims), active_dims=dims,
+                    variances=var, name=name)
+            kernel = kern if kernel is None else kernel + kern
+        link = GPy.likelihoods.link_functions.RaoKupper(self.alpha)
+        likelihood = GPy.likelihoods.Bernoulli(gp_link=link)
+        method = expectation_propagation.EP(parallel_updates=parallel)
+        n = self.featmat.shape[0]
+        if warm_start and self.gp is not None:
+            # Sites of the previous games are reused, new ones start at 0.
+            sites = self.gp.inference_method.ga_approx_old
+            pad = np.zeros(n - len(sites.v))
+            approx = expectation_propagation.gaussianApproximation
+            method.ga_approx_old = approx(np.concatenate((sites.v, pad)),
+                    np.concatenate((sites.tau, pad)))
+        self.gp = GPy.core.GP(
+                X=self.inputs.transform(self.featmat), Y=np.ones((n, 1)),
+                kernel=kernel, likelihood=likelihood, inference_method=method)
+        # EP runs when the model is built; its iterations are internal to GPy.
+        self.diagnostics.info.update(
+                log_likelihood=float(self.gp.log_likelihood()))
+        self.posterior = None
+
+    def fit(self, games, parallel=True, backend="gp"):
+        # `games` can be a query, a list of games or a `GameData` instance.
+        # See `_infer` for the choice of `backend`. Returns the diagnostics
+        # of the fit (also in `self.diagnostics`), with the time spent
+        # loading the games, building the features, building the design
+        # matrix, and in inference.
+        self.diagnostics = FitDiagnostics()
+        with self.diagnostics.phase("load"):
+            data = as_game_data(games)
+        self._prepare(data)
+        self._infer(parallel, backend)
+        return self.diagnostics
+
+    def predict_many(self, games):
+        # The time spent predicting is added to `self.diagnostics`.
+        with self.diagnostics.phase("prediction"):
+            return self._outcome_probs(
+                    self._predict_featmat(as_game_data(games)))
+
+    def _prepare(self, data):
+        with self.diagnostics.phase("features"):
+            self._build_features(data)
+        with self.diagnostics.phase("design_matrix"):
+            self._build_featmat(data)
+
+    def update(self, games, parallel=True, backend="gp"):
+        """Add games to the training data, and refit the model.
+
+        The features and the design matrix are extended with the new games
+        only, and inference is warm-started from the previous fit (EP sites,
+        or weights). The result is the same as that of `fit` on all the
+        games. Inference still runs on all the games seen so far, hence the
+        cost of an update grows with the history: O(n^3) in the number n of
+        games with the "gp" backend, O(nnz + d^3) with the "weights" backend
+        (nnz non-zero entries in the design matrix, d features), and the
+        design matrix is copied. On a model
+        that has not been fitted yet, this is equivalent to `fit`.
+        """
+        self.diagnostics = FitDiagnostics()
+        with self.diagnostics.phase("load"):
+            data = as_game_data(games)
+        old = getattr(self, "featmat", None)
+        with self.diagnostics.phase("features"):
+            self._extend_features(data)
+        with self.diagnostics.phase("design_matrix"):
+            self._build_featmat(data)
+            if old is not None:
+                old = old.copy()
+                old.resize((old.shape[0], len(self.features)))
+                self.featmat = vstack((old, self.featmat), format="csr")
+        self._infer(parallel, backend, warm_start=old is not None)
+        return self.diagnostics
 
-class ActorGPModel(PredictiveModel):
+    def extend_features(self, games):
+        """Add the features of `games` that are new to the model.
+
+        New features (e.g., a team that has not played yet) keep their prior.
+        Games that are not in the training data need this before they can be
+        predicted.
+        """
+        self._extend_features(as_game_data(games))
+
+    def _outcome_probs(self, featmat):
+        # Probabilities of the three outcomes, one row per row of `featmat`.
+        prob_win, prob_lose = self._predict_probs(featmat)
+        return np.column_stack((prob_win, 1.0 - prob_win - prob_lose,
+                prob_lose))
+
+    def _predict_probs(self, featmat):
+        # Probabilities of a win and of a loss, for each row of `featmat`.
+        if self.gp is None:
+            return (self.posterior.predict(featmat),
+                    self.posterior.predict(-featmat))
+        Xnew = self.inputs.transform(featmat)
+        mean, _ = self.gp.predict(Xnew)
+        prob_win = mean[:, 0]
+        mean, _ = self.gp.predict(-Xnew)
+        prob_lose = mean[:, 0]
+        return prob_win, prob_lose
+
+
+class ActorGPModel(_LinearKernelModel):
+
+    GROUP = "actors"
 
     def __init__(self, alpha, home_advantage=True, **hyperparams):
         self.alpha = alpha
@@ -29,70 +268,46 @@ class ActorGPModel(PredictiveModel):
         self.hyperparams = hyperparams
         self.features = Features()
         self.gp = None
+        self.posterior = None
+        self.diagnostics = FitDiagnostics()
 
-    def _build_features(self):
+    def _build_features(self, data):
         self.features.add("home_adv")
-        for actor in Actor.select():
-            self.features.add(actor.id, group="actors")
-
-    def _build_featmat(self, games):
-        # Each row is a game, each column is a player.
-        featmat = list()
-        for game in games:
-            if len(game.participants) == 0:
-                # There were no players for this game.
-                continue
-            if game.score_home_ft >= game.score_away_ft:
-                vec = self.features.new_vector()
-                for p in game.participants:
-                    if p.ratio == 0:
-                        continue
-                    elif p.team_id == game.team_home_id:
-                        vec[p.actor_id] = +p.ratio
-                    else:
-                        vec[p.actor_id] = -p.ratio
-                if not game.is_neutral:
-                    vec["home_adv"] = +1.0
-                featmat.append(vec.as_array())
-            if game.score_home_ft <= game.score_away_ft:
-                vec = self.features.new_vector()
-                for p in game.participants:
-                    if p.ratio == 0:
-                        continue
-                    elif p.team_id == game.team_home_id:
-                        vec[p.actor_id] = -p.ratio
-                    else:
-                        vec[p.actor_id] = +p.ratio
-                if not game.is_neutral:
-                    vec["home_adv"] = -1.0
-                featmat.append(vec.as_array())
-        self.featmat = np.array(featmat)
-
-    def fit(self, games, parallel=True):
-        self._build_features()
-        self._build_featmat(games)
-        # Kernel for the teams.
-        indices = self.features.get_group("actors")
-        var = self.hyperparams.get("actors_var", 1.0)
-        k_actors = GPy.kern.Linear(
-                input_dim=len(indices), active_dims=indices, variances=var,
-                name="actors")
-        # Kernel for the home advantage.
-        idx = self.features.get_idx("home_adv")
-        var = self.hyperparams.get("home_adv_var", 1.0)
-        k_home_adv = GPy.kern.Linear(
-                input_dim=1, active_dims=[idx], variances=var, name="home_adv")
-        # Putting it all together.
-        kernel = k_actors
-        if self.home_advantage:
-            kernel += k_home_adv
-        link = GPy.likelihoods.link_functions.RaoKupper(self.alpha)
-        likelihood = GPy.likelihoods.Bernoulli(gp_link=link)
-        method = expectation_propagation.EP(parallel_updates=parallel)
-        n = self.featmat.shape[0]
-        self.gp = GPy.core.GP(
-                X=self.featmat, Y=np.ones((n, 1)), kernel=kernel,
-                likelihood=likelihood, inference_method=method)
+        # All the actors of the database, from the snapshot if available.
+        if data.actor_ids is not None:
+            actor_ids = data.actor_ids.tolist()
+        else:
+            actor_ids = [aid for aid, in Actor.select(Actor.id).tuples()]
+        for actor_id in actor_ids:
+            self.features.add(actor_id, group="actors")
+
+    def _extend_features(self, data):
+        if len(self.features) == 0:
+            self._build_features(data)
+        # Actors added to the database since the features were built.
+        for actor_id in np.unique(data.part_actor).tolist():
+            self.features.add(actor_id, group="actors")
+
+    def _build_featmat(self, data):
+        # Each row is a game, each column is a player. Games without players
+        # are skipped.
+        row_game, row_sign = data.outcome_rows()
+        keep = data.n_participants()[row_game] > 0
+        row_game, row_sign = row_game[keep], row_sign[keep]
+        entry_row, part = data.expand(row_game)
+        keep = data.part_ratio[part] != 0
+        entry_row, part = entry_row[keep], part[keep]
+        is_home = data.part_team[part] == data.team_home[data.part_game[part]]
+        vals = (row_sign[entry_row] * np.where(is_home, 1.0, -1.0)
+                * data.part_ratio[part])
+        home = np.flatnonzero(~data.is_neutral[row_game])
+        self.featmat = self.features.build_matrix(
+                np.concatenate((entry_row, home)),
+                np.concatenate((
+                    self.features.get_indices(data.part_actor[part]),
+                    np.full(len(home), self.features.get_idx("home_adv")))),
+                np.concatenate((vals, row_sign[home])),
+                len(row_game))
 
     def predict(self, game):
         vec = self.features.new_vector()
@@ -104,16 +319,33 @@ class ActorGPModel(PredictiveModel):
         if not game.is_neutral:
             vec["home_adv"] = +1.0
         # Second, we compute the predictive mean and variance
-        Xnew = np.array([vec.as_array()])
-        mean, _ = self.gp.predict(Xnew)
-        prob_win = mean[0, 0]
-        mean, _ = self.gp.predict(-Xnew)
-        prob_lose = mean[0, 0]
+        prob_win, prob_lose = self._predict_probs(vec.as_sparse())
+        prob_win, prob_lose = prob_win[0], prob_lose[0]
         prob_draw = 1.0 - prob_win - prob_lose
         return (prob_win, prob_draw, prob_lose)
 
+    def _predict_featmat(self, data):
+        # Same features as `predict`, for all the games at once.
+        entry_row, part = data.expand(np.arange(len(data)))
+        game = data.part_game[part]
+        is_home = data.part_team[part] == data.team_home[game]
+        is_away = data.part_team[part] == data.team_away[game]
+        keep = data.part_is_starter[part] & (is_home | is_away)
+        home = np.flatnonzero(~data.is_neutral)
+        return self.features.build_matrix(
+                np.concatenate((entry_row[keep], home)),
+                np.concatenate((
+                    self.features.get_indices(data.part_actor[part[keep]]),
+                    np.full(len(home), self.features.get_idx("home_adv")))),
+                np.concatenate((
+                    np.where(is_home[keep], 1.0, -1.0),
+                    np.ones(len(home)))),
+                len(data))
+
 
-class TeamGPModel(PredictiveModel):
+class TeamGPModel(_LinearKernelModel):
+
+    GROUP = "teams"
 
     def __init__(self, alpha, home_advantage=True, **hyperparams):
         self.alpha = alpha
@@ -121,59 +353,33 @@ class TeamGPModel(PredictiveModel):
         self.hyperparams = hyperparams
         self.features = Features()
         self.gp = None
+        self.posterior = None
+        self.diagnostics = FitDiagnostics()
 
-    def _build_features(self, games):
+    def _build_features(self, data):
         self.features.add("home_adv")
         # TODO Maybe here we should just use all the teams in the DB.
-        for game in games:
-            self.features.add(game.team_home.name, group="teams")
-            self.features.add(game.team_away.name, group="teams")
+        for home, away in zip(data.team_home_name, data.team_away_name):
+            self.features.add(home, group="teams")
+            self.features.add(away, group="teams")
         self.features.add("Poland", group="teams")
         self.features.add("Ukraine", group="teams")
 
-    def _build_featmat(self, games):
-        featmat = list()
-        for game in games:
-            if game.score_home_ft >= game.score_away_ft:
-                vec = self.features.new_vector()
-                vec[game.team_home.name] = +1.0
-                vec[game.team_away.name] = -1.0
-                if not game.is_neutral:
-                    vec["home_adv"] = +1.0
-                featmat.append(vec.as_array())
-            if game.score_home_ft <= game.score_away_ft:
-                vec = self.features.new_vector()
-                vec[game.team_home.name] = -1.0
-                vec[game.team_away.name] = +1.0
-                if not game.is_neutral:
-                    vec["home_adv"] = -1.0
-                featmat.append(vec.as_array())
-        self.featmat = np.array(featmat)
-
-    def fit(self, games, parallel=True):
-        self._build_features(games)
-        self._build_featmat(games)
-        # Kernel for the teams.
-        indices = self.features.get_group("teams")
-        var = self.hyperparams.get("teams_var", 1.0)
-        k_teams = GPy.kern.Linear(input_dim=len(indices), active_dims=indices,
-                variances=var, name="teams")
-        # Kernel for the home advantage.
-        idx = self.features.get_idx("home_adv")
-        var = self.hyperparams.get("home_adv_var", 1.0)
-        k_home_adv = GPy.kern.Linear(input_dim=1, active_dims=[idx],
-                variances=var, name="home_adv")
-        # Putting it all together.
-        kernel = k_teams
-        if self.home_advantage:
-            kernel += k_home_adv
-        link = GPy.likelihoods.link_functions.RaoKupper(self.alpha)
-        likelihood = GPy.likelihoods.Bernoulli(gp_link=link)
-        method = expectation_propagation.EP(parallel_updates=parallel)
-        n = self.featmat.shape[0]
-        self.gp = GPy.core.GP(
-                X=self.featmat, Y=np.ones((n, 1)), kernel=kernel,
-                likelihood=likelihood, inference_method=method)
+    def _extend_features(self, data):
+        self._build_features(data)
+
+    def _build_featmat(self, data):
+        row_game, row_sign = data.outcome_rows()
+        rows = np.arange(len(row_game))
+        home = np.flatnonzero(~data.is_neutral[row_game])
+        self.featmat = self.features.build_matrix(
+                np.concatenate((rows, rows, home)),
+                np.concatenate((
+                    self.features.get_indices(data.team_home_name[row_game]),
+                    self.features.get_indices(data.team_away_name[row_game]),
+                    np.full(len(home), self.features.get_idx("home_adv")))),
+                np.concatenate((+row_sign, -row_sign, row_sign[home])),
+                len(row_game))
 
     def predict(self, game):
         vec = self.features.new_vector()
@@ -182,10 +388,22 @@ class TeamGPModel(PredictiveModel):
         if not game.is_neutral:
             vec["home_adv"] = +1.0
         # Second, we compute the predictive mean and variance
-        Xnew = np.array([vec.as_array()])
-        mean, _ = self.gp.predict(Xnew)
-        prob_win = mean[0, 0]
-        mean, _ = self.gp.predict(-Xnew)
-        prob_lose = mean[0, 0]
+        prob_win, prob_lose = self._predict_probs(vec.as_sparse())
+        prob_win, prob_lose = prob_win[0], prob_lose[0]
         prob_draw = 1.0 - prob_win - prob_lose
         return (prob_win, prob_draw, prob_lose)
+
+    def _predict_featmat(self, data):
+        # Same features as `predict`, for all the games at once.
+        rows = np.arange(len(data))
+        home = np.flatnonzero(~data.is_neutral)
+        return self.features.build_matrix(
+                np.concatenate((rows, rows, home)),
+                np.concatenate((
+                    self.features.get_indices(data.team_home_name),
+                    self.features.get_indices(data.team_away_name),
+                    np.full(len(home), self.features.get_idx("home_adv")))),
+                np.concatenate((
+                    np.ones(len(data)), -np.ones(len(data)),
+                    np.ones(len(home)))),
+                len(data))
@@ -0,0 +1,122 @@
+"""Grid search over the hyperparameters of linear-kernel models.
+
+The features and the design matrices (of the training and of the test games)
+do not depend on the hyperparameters: they are built once, and only
+inference is run for each point of the grid. With several processes, the
+matrices are written once to disk and memory-mapped by the workers, which
+therefore share them (through the page cache) instead of receiving a copy
+with every task.
+"""
+import copy
+import itertools
+import numpy as np
+import os
+import tempfile
+
+from concurrent.futures import ProcessPoolExecutor
+from scipy.sparse import csr_matrix
+
+from ..diagnostics import FitDiagnostics
+from .gamedata import as_game_data
+from .utils import _chunksize, _init_predictor, _predict
+
+
+def grid_search(model, games, test_set, grid, processes=None, parallel=True,
+        backend="gp"):
+    """Evaluate `model` on `test_set` for every point of `grid`.
+
+    `model` is an unfitted `ActorGPModel` or `TeamGPModel`, whose `alpha` and
+    hyperparameters are the defaults for the values not in `grid`. `grid`
+    maps `"alpha"` or hyperparameter names (e.g., `"actors_var"`) to lists of
+    values; all their combinations are evaluated. The model is trained on
+    `games` and evaluated on the games of `test_set` (a `TestSet`). Points
+    are spread over a pool of `processes` worker processes (by default, one
+    per CPU); with `processes=1`, they run sequentially. `parallel` and
+    `backend` are passed to `fit`.
+
+    Returns a structured array with one row per point of the grid, with a
+    field for each parameter of `grid` and the fields `log_loss` and
+    `zero_one_loss`.
+    """
+    names = list(grid)
+    points = [dict(zip(names, vals))
+            for vals in itertools.product(*(grid[name] for name in names))]
+    base = copy.copy(model)
+    base.features = copy.deepcopy(model.features)
+    base.diagnostics = FitDiagnostics()
+    base._prepare(as_game_data(games))
+    train = base.featmat
+    # Features of the test games that are not in the training games keep
+    # their prior.
+    test_data = as_game_data(test_set.games)
+    base.extend_features(test_data)
+    train.resize((train.shape[0], len(base.features)))
+    test = base._predict_featmat(test_data)
+    base.featmat = None
+    if processes == 1:
+        evaluate = _Evaluator(base, train, test, parallel, backend)
+        probs = [evaluate(point) for point in points]
+    else:
+        processes = processes or os.cpu_count() or 1
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # Workers receive the evaluator once, when they start.
+            evaluate = _Evaluator(base, _dump(train, tmpdir, "train"),
+                    _dump(test, tmpdir, "test"), parallel, backend)
+            with ProcessPoolExecutor(max_workers=processes,
+                    initializer=_init_predictor,
+                    initargs=(evaluate,)) as executor:
+                probs = list(executor.map(_predict, points,
+                        chunksize=_chunksize(len(points), processes)))
+    dtype = ([(name, float) for name in names]
+            + [("log_loss", float), ("zero_one_loss", int)])
+    table = np.zeros(len(points), dtype=dtype)
+    for k, (point, pred) in enumerate(zip(points, probs)):
+        res = test_set.results(pred)
+        table[k] = tuple(point[name] for name in names) + (
+                res.log_loss, res.zero_one_loss)
+    return table
+
+
+def _dump(mat, tmpdir, prefix):
+    # Saves the arrays of a CSR matrix, returns what `_load` needs.
+    paths = list()
+    for name in ("data", "indices", "indptr"):
+        path = os.path.join(tmpdir, "{}-{}.npy".format(prefix, name))
+        np.save(path, getattr(mat, name))
+        paths.append(path)
+    return paths, mat.shape
+
+
+def _load(dumped):
+    paths, shape = dumped
+    arrays = [np.load(path, mmap_mode="r") for path in paths]
+    return csr_matrix(tuple(arrays), shape=shape, copy=False)
+
+
+class _Evaluator:
+
+    """Fits the model for a point of the grid, predicts the test games.
+
+    The design matrices are either CSR matrices, or matrices saved with
+    `_dump`, which are memory-mapped when the first point is evaluated.
+    """
+
+    def __init__(self, base, train, test, parallel, backend):
+        self.base = base
+        self.train, self.test = train, test
+        self.parallel, self.backend = parallel, backend
+
+    def __call__(self, point):
+        if not isinstance(self.train, csr_matrix):
+            self.train, self.test = _load(self.train), _load(self.test)
+        model = copy.copy(self.base)
+        model.hyperparams = dict(model.hyperparams)
+        model.diagnostics = FitDiagnostics()
+        for name, val in point.items():
+            if name == "alpha":
+                model.alpha = val
+            else:
+                model.hyperparams[name] = val
+        model.featmat = self.train
+        model._infer(self.parallel, self.backend)
+        return model._outcome_probs(self.test)
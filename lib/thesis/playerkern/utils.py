@@ -1,10 +1,13 @@
 import enum
 import collections
 import numpy as np
+import os
 
 from .data_models import Game, Team
+from .gamedata import GameData
 
-from math import log
+from concurrent.futures import ProcessPoolExecutor
+from scipy.sparse import csr_matrix
 
 
 class Outcome(enum.Enum):
@@ -17,71 +20,162 @@ class Outcome(enum.Enum):
 class TestSet:
 
     def __init__(self, games):
+        # `games` is a list of `Game` instances, or a `GameData` instance
+        # (e.g., from a snapshot), which only supports `evaluate`.
         self._games = games
 
+    @property
+    def games(self):
+        """The games of the test set."""
+        return self._games
+
     @classmethod
     def from_games(cls, where_clause):
+        if isinstance(where_clause, GameData):
+            # Games of a snapshot, selected beforehand with `subset`. Games
+            # without a score (e.g., upcoming) cannot be evaluated.
+            data = where_clause
+            return cls(data.subset(~np.isnan(data.score_home_ft)
+                    & ~np.isnan(data.score_away_ft)))
         games = list()
         for game in Game.select(Game, Team).join(Team).where(where_clause):
             games.append(game)
         return cls(games)
 
-    def evaluate_fct(self, predictor):
-        results = collections.OrderedDict()
-        for game in self._games:
-            if game.score_home_ft > game.score_away_ft:
-                outcome = Outcome.win
-            elif game.score_home_ft < game.score_away_ft:
-                outcome = Outcome.loss
-            else:
-                outcome = Outcome.tie
-            results[game.id] = (game, outcome, predictor(game))
-        return TestResults(results)
+    @staticmethod
+    def _outcome(game):
+        if game.score_home_ft > game.score_away_ft:
+            return Outcome.win
+        elif game.score_home_ft < game.score_away_ft:
+            return Outcome.loss
+        else:
+            return Outcome.tie
+
+    def evaluate_fct(self, predictor, executor=None, processes=None,
+            chunksize=None):
+        # With `processes`, the predictor is mapped over the games by a pool
+        # of worker processes, which receive the predictor once, when they
+        # start, and the games in chunks of `chunksize` (by default, about
+        # four chunks per process). Another executor (e.g., a thread pool
+        # from `concurrent.futures`) can be given instead; with a process
+        # pool, the predictor is then sent with every chunk. The predictor
+        # and the games must be picklable for processes.
+        # Predictors that query the database (e.g., `game.participants`) need
+        # a connection in each worker. With the "fork" start method, workers
+        # inherit the connection of the parent, which must not be shared:
+        # close it first (`DB_PROXY.close()`), and workers open their own.
+        # With "spawn", `DB_PROXY` is not initialized in the workers, and the
+        # predictor must call `init_db` itself.
+        assert not isinstance(self._games, GameData), (
+                "predictors need instances of `Game`")
+        if executor is None and processes is None:
+            preds = [predictor(game) for game in self._games]
+        elif executor is None:
+            chunksize = chunksize or _chunksize(len(self._games), processes)
+            with ProcessPoolExecutor(max_workers=processes,
+                    initializer=_init_predictor,
+                    initargs=(predictor,)) as executor:
+                preds = list(executor.map(
+                        _predict, self._games, chunksize=chunksize))
+        else:
+            chunksize = chunksize or _chunksize(
+                    len(self._games), os.cpu_count() or 1)
+            preds = list(executor.map(
+                    predictor, self._games, chunksize=chunksize))
+        return self.results(preds)
 
     def evaluate(self, model):
-        return self.evaluate_fct(model.predict)
+        if not hasattr(model, "predict_many"):
+            return self.evaluate_fct(model.predict)
+        # Vectorized predictions for all the games at once.
+        return self.results(model.predict_many(self._games))
+
+    def results(self, preds):
+        """Results of predictions `preds`, one row per game of the set."""
+        if isinstance(self._games, GameData):
+            return TestResults(
+                    self._games.id, self._games.outcomes(), preds)
+        outcomes = [self._outcome(game).value - 1 for game in self._games]
+        return TestResults(self._games, outcomes, preds)
+
+
+# State of a worker process, set by `_init_predictor`.
+_STATE = dict()
+
+
+def _init_predictor(predictor):
+    _STATE.update(predictor=predictor)
+
+
+def _predict(game):
+    return _STATE["predictor"](game)
+
+
+def _chunksize(n_items, n_workers):
+    return max(1, n_items // (4 * n_workers))
 
 
 class TestResults:
 
-    def __init__(self, results):
-        self._results = results
+    """Outcomes of a set of games, and the probabilities predicted for them.
+
+    Outcomes are stored as codes (0: win, 1: tie, 2: loss), i.e., as the
+    column of the matching probability in the (n, 3) prediction matrix.
+    """
+
+    def __init__(self, games, outcomes, probs):
+        self.games = games
+        self.outcomes = np.asarray(outcomes, dtype=int)
+        self.probs = np.asarray(probs, dtype=float).reshape(-1, 3)
 
     def __len__(self):
-        return len(self._results)
+        return len(self.outcomes)
 
     @property
     def zero_one_loss(self):
-        loss = 0
-        for game, outcome, pred in self._results.values():
-            if np.argmax(pred) == 0 and outcome is not Outcome.win:
-                loss += 1
-            elif np.argmax(pred) == 1 and outcome is not Outcome.tie:
-                loss += 1
-            elif np.argmax(pred) == 2 and outcome is not Outcome.loss:
-                loss += 1
-        return loss
+        return int(np.count_nonzero(
+                np.argmax(self.probs, axis=1) != self.outcomes))
 
     @property
     def log_loss(self):
-        loss = 0
-        for game, outcome, pred in self._results.values():
-            try:
-                if outcome is Outcome.win:
-                    loss += -log(pred[0])
-                elif outcome is Outcome.tie:
-                    loss += -log(pred[1])
-                else:  # outcome is Outcome.loss
-                    loss += -log(pred[2])
-            except ValueError:
-                # We probably tried to compute `log(0)`.
-                return float("inf")
-        return loss
+        probs = self.probs[np.arange(len(self)), self.outcomes]
+        if np.any(probs <= 0):
+            # We would compute `log(0)`.
+            return float("inf")
+        return float(-np.sum(np.log(probs)))
+
+    @property
+    def brier_score(self):
+        """Squared error of the probabilities, summed over the games."""
+        onehot = np.zeros_like(self.probs)
+        onehot[np.arange(len(self)), self.outcomes] = 1.0
+        return float(np.sum((self.probs - onehot)**2))
+
+    def calibration(self, n_bins=10):
+        """Compare predicted probabilities to observed frequencies.
+
+        The probabilities of all the outcomes of all the games are grouped
+        into `n_bins` equal-width bins. Returns, for each bin, the mean
+        predicted probability, the frequency of the corresponding outcomes
+        and the number of probabilities in the bin (empty bins give NaNs).
+        """
+        probs = self.probs.ravel()
+        observed = np.zeros_like(self.probs)
+        observed[np.arange(len(self)), self.outcomes] = 1.0
+        bins = np.minimum((probs * n_bins).astype(int), n_bins - 1)
+        counts = np.bincount(bins, minlength=n_bins)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean_pred = np.bincount(
+                    bins, weights=probs, minlength=n_bins) / counts
+            freq = np.bincount(
+                    bins, weights=observed.ravel(), minlength=n_bins) / counts
+        return mean_pred, freq, counts
 
     def print_summary(self):
         print("number of samples:", len(self))
         print("0-1 loss: {:.3f}".format(self.zero_one_loss))
         print("log loss: {:.3f}".format(self.log_loss))
+        print("Brier score: {:.3f}".format(self.brier_score))
 
 
 class Features:
@@ -106,24 +200,59 @@ class Features:
     def get_idx(self, feature_name):
         return self._idx[feature_name]
 
+    def get_indices(self, feature_names):
+        """Vectorized version of `get_idx`, for an array of names."""
+        # Names are not sorted, as they may mix types (e.g., `None`).
+        names = np.ravel(feature_names).tolist()
+        return np.fromiter(map(self._idx.__getitem__, names), dtype=int,
+                count=len(names))
+
     def new_vector(self):
         return FeatureVector(self)
 
+    def build_matrix(self, rows, cols, vals, n_rows):
+        """Build a sparse (CSR) matrix with one column per feature.
+
+        `rows`, `cols` and `vals` give the non-zero entries. As with
+        `FeatureVector`, later entries overwrite earlier ones.
+        """
+        rows, cols = np.asarray(rows, dtype=int), np.asarray(cols, dtype=int)
+        # Keep the last occurrence of each (row, col) pair.
+        keys = rows * len(self) + cols
+        _, last = np.unique(keys[::-1], return_index=True)
+        last = len(keys) - 1 - last
+        return csr_matrix(
+                (np.asarray(vals, dtype=float)[last], (rows[last], cols[last])),
+                shape=(n_rows, len(self)))
+
 
 class FeatureVector:
 
+    """Sparse feature vector, storing only its non-zero entries."""
+
     def __init__(self, features, base=None):
+        self._entries = dict()  # Maps feature indices to values.
         if base is not None:
-            self._vec = np.copy(base)
-        else:
-            self._vec = np.zeros(len(features), dtype=float)
+            for idx in np.flatnonzero(base):
+                self._entries[idx] = base[idx]
         self._feats = features
 
     def __setitem__(self, key, val):
-        self._vec[self._feats.get_idx(key)] = val
+        self._entries[self._feats.get_idx(key)] = val
 
     def __getitem__(self, key):
-        return self._vec[self._feats.get_idx(key)]
+        return self._entries.get(self._feats.get_idx(key), 0.0)
 
     def as_array(self):
-        return self._vec
+        vec = np.zeros(len(self._feats), dtype=float)
+        vec[list(self._entries.keys())] = list(self._entries.values())
+        return vec
+
+    def as_sparse(self):
+        """Return the vector as a 1-by-d CSR matrix."""
+        idx = np.fromiter(self._entries.keys(), dtype=int,
+                count=len(self._entries))
+        vals = np.fromiter(self._entries.values(), dtype=float,
+                count=len(self._entries))
+        return csr_matrix((vals, idx, [0, len(idx)]),
+                shape=(1, len(self._feats)))
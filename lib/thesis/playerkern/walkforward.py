@@ -0,0 +1,50 @@
+"""Walk-forward evaluation of predictive models.
+
+The games are split into consecutive time windows. The games of each window
+are predicted by a model trained on all the previous games, and then added
+to the training data with `update`, which extends the design matrix with the
+new rows and warm-starts inference from the previous fit. Inference still
+runs on all the previous games, so later windows are slower to refit.
+"""
+import datetime
+import numpy as np
+
+from .gamedata import as_game_data
+from .utils import TestResults
+
+
+def backtest(model, games, start, end, step=datetime.timedelta(days=7),
+        parallel=True, backend="gp"):
+    """Walk-forward backtest of `model` on `games`.
+
+    The model is first fitted on the games played before `start`, then the
+    games in `[start, end)` are predicted window by window, each window
+    spanning `step`. Games without a score are never predicted. Returns a
+    `TestResults` instance, whose `games` are the IDs of the predicted games.
+    """
+    data = as_game_data(games)
+    data = data.subset(np.argsort(data.kickoff_time, kind="stable"))
+    start, end = np.datetime64(start, "s"), np.datetime64(end, "s")
+    step = np.timedelta64(step, "s")
+    model.fit(data.subset(data.kickoff_time < start),
+            parallel=parallel, backend=backend)
+    ids, outcomes, probs = list(), list(), list()
+    lo = start
+    while lo < end:
+        hi = min(lo + step, end)
+        mask = (data.kickoff_time >= lo) & (data.kickoff_time < hi)
+        window = data.subset(mask & ~np.isnan(data.score_home_ft))
+        lo = hi
+        if len(window) == 0:
+            continue
+        # Features of the window that are new to the model (e.g., a team that
+        # has not played yet) keep their prior.
+        model.extend_features(window)
+        ids.append(window.id)
+        outcomes.append(window.outcomes())
+        probs.append(model.predict_many(window))
+        model.update(window, parallel=parallel, backend=backend)
+    if not ids:
+        return TestResults([], [], np.zeros((0, 3)))
+    return TestResults(np.concatenate(ids), np.concatenate(outcomes),
+            np.concatenate(probs))
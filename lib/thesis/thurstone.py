@@ -1,10 +1,35 @@
 """(Penalized) maximum-likelihood inference for Thurstone's model."""
+import functools
 import numpy as np
+import os
 
+from .diagnostics import FitDiagnostics
+
+from concurrent.futures import ProcessPoolExecutor
+from scipy.linalg import cho_factor, cho_solve
 from scipy.optimize import minimize
+from scipy.sparse import coo_matrix, csr_matrix, diags, issparse
+from scipy.sparse.linalg import cg, LinearOperator
+from scipy.special import log_ndtr
 from scipy.stats import norm
 
 
+_LOG_SQRT_2PI = 0.5 * np.log(2 * np.pi)
+
+
+def _inv_mills(diffs, logcdfs):
+    """Compute the ratios `pdf(x) / cdf(x)` in log-space, overwriting `diffs`.
+
+    Working in log-space keeps the ratios finite (and accurate) for large
+    negative differences, where both the density and the CDF underflow.
+    """
+    np.square(diffs, out=diffs)
+    diffs *= -0.5
+    diffs -= _LOG_SQRT_2PI
+    diffs -= logcdfs
+    return np.exp(diffs, out=diffs)
+
+
 class _Functions:
 
     """Optimization-related methods for Thurstone's pairwise comparison model.
@@ -17,6 +42,7 @@ class _Functions:
     def __init__(self, mat, penalty):
         self._mat = mat
         self._penalty = penalty
+        self._curv_at = None
 
     def objective(self, params):
         """Compute the negative penalized log-likelihood."""
@@ -26,26 +52,415 @@ class _Functions:
         return reg - np.sum(self._mat * norm.logcdf(diffs))
 
     def gradient(self, params):
+        return self.fused(params)[1]
+
+    def fused(self, params):
+        """Compute the objective and its gradient in a single pass."""
+        diffs = np.subtract.outer(params, params)  # diffs[i,j] = x[i] - x[j]
+        logcdfs = log_ndtr(diffs)
+        obj = (self._penalty * np.sum(params**2)
+                - np.vdot(self._mat, logcdfs))
+        ratios = _inv_mills(diffs, logcdfs)
+        ratios *= self._mat
+        grad = (2 * self._penalty * params
+                + ratios.sum(axis=0) - ratios.sum(axis=1))
+        return obj, grad
+
+    def hessp(self, params, vec):
+        """Compute the product of the Hessian with a vector."""
+        curv = self._curvature(params)
+        return (2 * self._penalty * vec
+                + curv.sum(axis=1) * vec - curv.dot(vec))
+
+    def hessian(self, params):
+        """Compute the Hessian, as a dense matrix."""
+        curv = self._curvature(params)
+        hess = -curv
+        hess[np.diag_indices_from(hess)] += (
+                2 * self._penalty + curv.sum(axis=1))
+        return hess
+
+    def _curvature(self, params):
+        # Symmetric matrix of second derivatives of each pair's term. It is
+        # cached, as solvers evaluate many products at the same point.
+        if self._curv_at is None or not np.array_equal(params, self._curv_at):
+            diffs = np.subtract.outer(params, params)
+            ratios = _inv_mills(diffs.copy(), log_ndtr(diffs))
+            diffs += ratios
+            diffs *= ratios
+            diffs *= self._mat
+            self._curv = diffs + diffs.T
+            self._curv_at = np.copy(params)
+        return self._curv
+
+
+class _SparseFunctions:
+
+    """Optimization-related methods for Thurstone's model, on sparse data.
+
+    Same as `_Functions`, but the data is given as the edges of the
+    comparison graph: item `winners[k]` won `counts[k]` times against item
+    `losers[k]`. Only observed pairs are visited, so the objective and its
+    gradient are computed in time linear in the number of edges.
+    """
+
+    def __init__(self, winners, losers, counts, penalty):
+        self._winners = winners
+        self._losers = losers
+        self._counts = counts
+        self._penalty = penalty
+        self._curv_at = None
+
+    def objective(self, params):
+        """Compute the negative penalized log-likelihood."""
+        reg = self._penalty * np.sum(params**2)
+        diffs = params[self._winners] - params[self._losers]
+        return reg - np.dot(self._counts, norm.logcdf(diffs))
+
+    def gradient(self, params):
+        return self.fused(params)[1]
+
+    def fused(self, params):
+        """Compute the objective and its gradient in a single pass."""
+        diffs = params[self._winners] - params[self._losers]
+        logcdfs = log_ndtr(diffs)
+        obj = (self._penalty * np.sum(params**2)
+                - np.dot(self._counts, logcdfs))
+        ratios = _inv_mills(diffs, logcdfs)
+        ratios *= self._counts
+        n = len(params)
         grad = 2 * self._penalty * params
-        diffs = np.tile(params, (len(params), 1))
-        diffs = diffs.T - diffs  # diffs[i,j] = x[i] - x[j]
-        with np.errstate(divide="ignore", invalid="ignore"):
-            ratios = norm.pdf(diffs) / norm.cdf(diffs)
-        for i in range(len(params)):
-            grad[i] += np.dot(self._mat[:,i], ratios[:,i])
-            grad[i] -= np.dot(self._mat[i,:], ratios[i,:])
-        return grad
-
-
-def thurstone_mle(mat, penalty=1e-6, max_iter=None, tol=1e-5):
-    # mat[i,j] should contain the number of wins of i against j.
-    assert mat.ndim == 2 and mat.shape[0] == mat.shape[1], (
-        "data should be a squared matrix with win counts")
-    x0 = np.zeros(mat.shape[0])
-    fcts = _Functions(mat, penalty)
+        grad += np.bincount(self._losers, weights=ratios, minlength=n)
+        grad -= np.bincount(self._winners, weights=ratios, minlength=n)
+        return obj, grad
+
+    def hessp(self, params, vec):
+        """Compute the product of the Hessian with a vector."""
+        prods = self._curvature(params) * (
+                vec[self._winners] - vec[self._losers])
+        n = len(params)
+        hvec = 2 * self._penalty * vec
+        hvec += np.bincount(self._winners, weights=prods, minlength=n)
+        hvec -= np.bincount(self._losers, weights=prods, minlength=n)
+        return hvec
+
+    def hessian(self, params):
+        """Compute the Hessian, as a sparse matrix."""
+        curv = self._curvature(params)
+        n = len(params)
+        rows = np.concatenate((self._winners, self._losers,
+                self._winners, self._losers, np.arange(n)))
+        cols = np.concatenate((self._winners, self._losers,
+                self._losers, self._winners, np.arange(n)))
+        vals = np.concatenate((curv, curv, -curv, -curv,
+                np.full(n, 2 * self._penalty)))
+        # Duplicate entries are summed when converting to CSC.
+        return coo_matrix((vals, (rows, cols)), shape=(n, n)).tocsc()
+
+    def _curvature(self, params):
+        # Second derivative of each edge's term, cached as in `_Functions`.
+        if self._curv_at is None or not np.array_equal(params, self._curv_at):
+            diffs = params[self._winners] - params[self._losers]
+            ratios = _inv_mills(diffs.copy(), log_ndtr(diffs))
+            self._curv = self._counts * ratios * (diffs + ratios)
+            self._curv_at = np.copy(params)
+        return self._curv
+
+
+def _edges(data, n_items=None):
+    """Convert sparse comparison data into the edges of the comparison graph.
+
+    `data` is either a `scipy.sparse` matrix of win counts, or a tuple
+    `(winners, losers)` or `(winners, losers, counts)` of arrays. Returns the
+    arrays of winners, losers and counts, and the number of items.
+    """
+    if issparse(data):
+        assert data.ndim == 2 and data.shape[0] == data.shape[1], (
+            "data should be a squared matrix with win counts")
+        coo = data.tocoo()
+        coo.sum_duplicates()
+        nz = coo.data != 0
+        return (coo.row[nz].astype(int), coo.col[nz].astype(int),
+                coo.data[nz].astype(float), coo.shape[0])
+    assert len(data) in (2, 3), (
+        "data should be a tuple (winners, losers[, counts])")
+    winners = np.asarray(data[0], dtype=int)
+    losers = np.asarray(data[1], dtype=int)
+    if len(data) == 3:
+        counts = np.asarray(data[2], dtype=float)
+    else:
+        counts = np.ones(len(winners))
+    assert winners.shape == losers.shape == counts.shape, (
+        "winners, losers and counts should have the same length")
+    if n_items is None:
+        n_items = max(winners.max(initial=-1), losers.max(initial=-1)) + 1
+    return winners, losers, counts, n_items
+
+
+# Solvers supported by `thurstone_mle`. The last two are second-order
+# methods using exact Hessian-vector products; their memory footprint is
+# linear in the number of items, whereas BFGS stores an n-by-n matrix.
+METHODS = ("BFGS", "Newton-CG", "trust-ncg")
+
+# Approximations of the marginal variances supported by `thurstone_mle`.
+VAR_APPROX = ("exact", "diagonal", "stochastic")
+
+
+def _minimize(fcts, x0, method, tol, max_iter, diagnostics=None,
+        callback=None):
+    assert method in METHODS, "method should be one of {}".format(METHODS)
     # `gtol`: Gradient norm must be less than gtol before successful
-    # termination [scipy doc].
+    # termination [scipy doc]. Newton-CG only supports a tolerance on the
+    # step size, `xtol`.
+    options = {"maxiter": max_iter}
+    options["xtol" if method == "Newton-CG" else "gtol"] = tol
+    hessp = None if method == "BFGS" else fcts.hessp
+    if diagnostics is None and callback is None:
+        return minimize(
+                fcts.fused, x0, method=method, jac=True, hessp=hessp,
+                options=options)
+    if diagnostics is None:
+        diagnostics = FitDiagnostics()
+    # The last evaluation is usually at the new iterate: it is reused to
+    # record the objective and the gradient's norm at each iteration.
+    last = dict()
+    def fused(params):
+        last["params"] = params.copy()
+        last["obj"], last["grad"] = fcts.fused(params)
+        return last["obj"], last["grad"]
+    def record(params):
+        if not np.array_equal(params, last.get("params")):
+            fused(params)
+        rec = diagnostics.record_iteration(
+                last["obj"], np.linalg.norm(last["grad"]))
+        if callback is not None:
+            callback(params, rec)
     res = minimize(
-            fcts.objective, x0, method="BFGS", jac=fcts.gradient,
-            options={"gtol": tol, "maxiter": max_iter})
-    return res.x
+            fused, x0, method=method, jac=True, hessp=hessp,
+            options=options, callback=record)
+    diagnostics.info.update(
+            method=method,
+            success=bool(res.success),
+            status=int(res.status),
+            message=str(res.message),
+            n_iter=int(res.nit),
+            n_fev=int(res.nfev),
+            n_jev=int(res.njev),
+            n_hev=int(getattr(res, "nhev", 0)),
+            objective=float(res.fun),
+            grad_norm=float(np.linalg.norm(res.jac)))
+    return res
+
+
+def _variances(fcts, params, approx="exact", n_probes=64, rng=None):
+    # Marginal variances of the Laplace approximation, i.e., the diagonal of
+    # the inverse Hessian `H` of the objective at `params`.
+    assert approx in VAR_APPROX, (
+        "approx should be one of {}".format(VAR_APPROX))
+    hess = fcts.hessian(params)
+    if approx == "exact":
+        # Dense Cholesky factorization: O(n^3) time and O(n^2) memory, which
+        # is fine up to a few thousand items only.
+        if issparse(hess):
+            hess = hess.toarray()
+        return np.diag(cho_solve(cho_factor(hess), np.eye(len(params))))
+    # `H` is a weighted graph Laplacian plus `2 * penalty * I`: the all-ones
+    # vector is an eigenvector, with eigenvalue `2 * penalty`. Along this
+    # direction (the unidentified mean of the parameters) the variance is
+    # `1 / (2 * penalty * n)`, exactly; it dominates when the penalty is
+    # small. The remaining part `B = (I - P) H^-1 (I - P)`, where `P`
+    # projects onto the all-ones vector, is approximated.
+    n = len(params)
+    mean_var = 1.0 / (2 * fcts._penalty * n)
+    hess = csr_matrix(hess)
+    diag = hess.diagonal()
+    inv = 1.0 / diag
+    offdiag = diags(diag) - hess  # `W`, with `H = D - W`.
+    # First terms of the Neumann series `H^-1 = D^-1 + D^-1 W D^-1
+    # + D^-1 W D^-1 W D^-1 + ...`; the diagonal of the second term is zero.
+    neumann = inv + inv**2 * offdiag.multiply(offdiag).dot(inv)
+    if approx == "diagonal":
+        # Truncated series, projected; O(number of comparisons) time.
+        return mean_var + neumann * (1 - 2.0 / n) + np.sum(neumann) / n**2
+    # Stochastic estimator of diag(B) [Bekas et al., 2007]: average of
+    # `v * B v` over random sign vectors `v`. Its error comes from the
+    # off-diagonal entries of `B`, the largest of which (between items that
+    # are compared, or that have an opponent in common) are removed with a
+    # control variate, the truncated series `C` above. Each probe takes one
+    # solve of `H x = (I - P) v` by conjugate gradients (one Hessian-vector
+    # product per iteration), and the error decreases as 1 / sqrt(n_probes).
+    rng = np.random.default_rng(0) if rng is None else rng
+    # Shifting `H` along the all-ones vector does not change the solutions
+    # for right-hand sides orthogonal to it, but makes the system well
+    # conditioned.
+    shift = np.mean(diag)
+    op = LinearOperator((n, n), dtype=float,
+            matvec=lambda x: hess.dot(x) + shift * np.mean(x))
+    num = np.zeros(n)
+    for _ in range(n_probes):
+        vec = rng.choice((-1.0, 1.0), size=n)
+        sol, _ = cg(op, vec - vec.mean(), M=diags(inv))
+        ctrl = inv * vec
+        term = ctrl
+        for _ in range(2):
+            term = inv * offdiag.dot(term)
+            ctrl = ctrl + term
+        num += vec * (sol - ctrl)
+    return mean_var + neumann + num / n_probes
+
+
+def thurstone_mle(mat, penalty=1e-6, max_iter=None, tol=1e-5, n_items=None,
+        method=None, x0=None, return_var=None, diagnostics=None,
+        callback=None):
+    """Compute the (penalized) maximum-likelihood estimates of the model.
+
+    `mat[i,j]` should contain the number of wins of `i` against `j`. `mat`
+    can also be a `scipy.sparse` matrix, or a tuple `(winners, losers[,
+    counts])` of edges of the comparison graph (`n_items` is then the number
+    of items, by default the largest index + 1). For sparse data, each
+    iteration takes time linear in the number of distinct pairs. `method` is
+    one of `METHODS`; by default, BFGS for dense matrices and Newton-CG for
+    sparse data, as BFGS stores an n-by-n matrix. `x0` is the starting point
+    of the optimizer (zero by default).
+
+    If `return_var` is one of `VAR_APPROX`, the marginal variances of the
+    Laplace approximation to the posterior (the penalty corresponds to a
+    Gaussian prior with precision `2 * penalty`, which must be positive) are
+    returned as well:
+
+    - "exact" inverts the dense Hessian, in O(n^3) time and O(n^2) memory;
+    - "stochastic" is accurate to a few percents, in the time of 64
+      conjugate-gradient solves;
+    - "diagonal" is a rougher approximation (truncated Neumann series), in
+      time linear in the number of compared pairs.
+
+    The approximations compute the variance along the (unidentified) mean of
+    the parameters exactly, and approximate the rest.
+
+    If `diagnostics` (a `FitDiagnostics` instance) is given, it records the
+    objective and the gradient's norm at each iteration, the convergence
+    information of the optimizer and the time spent in each phase.
+    `callback(params, record)` is called after each iteration, with the
+    record of the iteration.
+    """
+    if return_var is not None and penalty <= 0:
+        raise ValueError("variances need a positive penalty")
+    if issparse(mat) or isinstance(mat, tuple):
+        winners, losers, counts, n_items = _edges(mat, n_items)
+        fcts = _SparseFunctions(winners, losers, counts, penalty)
+        method = method or "Newton-CG"
+    else:
+        assert mat.ndim == 2 and mat.shape[0] == mat.shape[1], (
+            "data should be a squared matrix with win counts")
+        n_items = mat.shape[0]
+        fcts = _Functions(mat, penalty)
+        method = method or "BFGS"
+    if x0 is None:
+        x0 = np.zeros(n_items)
+    diag = FitDiagnostics() if diagnostics is None else diagnostics
+    with diag.phase("optimize"):
+        params = _minimize(
+                fcts, x0, method, tol, max_iter, diagnostics, callback).x
+    if return_var is not None:
+        with diag.phase("variances"):
+            var = _variances(fcts, params, approx=return_var)
+        return params, var
+    return params
+
+
+def thurstone_mle_batch(mats, processes=None, **kwargs):
+    """Fit Thurstone's model independently on each dataset in `mats`.
+
+    `mats` is either a 3-D array of stacked win-count matrices, or a sequence
+    of datasets in any of the formats accepted by `thurstone_mle` (all with
+    the same number of items). Fits are spread over a pool of `processes`
+    worker processes (by default, one per CPU); with `processes=1`, they run
+    sequentially in the current process. Remaining keyword arguments are
+    passed to `thurstone_mle`. Returns a matrix whose `k`-th row contains the
+    estimates for the `k`-th dataset.
+    """
+    fit = functools.partial(thurstone_mle, **kwargs)
+    if processes == 1:
+        return np.array([fit(mat) for mat in mats])
+    processes = processes or os.cpu_count() or 1
+    # Chunks amortize the cost of sending tasks to the workers.
+    chunksize = max(1, len(mats) // (4 * processes))
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return np.array(list(executor.map(fit, mats, chunksize=chunksize)))
+
+
+class IncrementalThurstone:
+
+    """Thurstone's model, refitted as new comparisons stream in.
+
+    Comparisons are aggregated into the edges of the comparison graph, which
+    are updated in place by `update`, in time proportional to the size of the
+    batch. Items are indexed by contiguous integers, and new items are added
+    as soon as they appear in a comparison. `fit` warm-starts the optimizer
+    from the previous estimates (new items start at zero), so that a refit
+    after a small update takes only a few iterations.
+    """
+
+    def __init__(self, penalty=1e-6, max_iter=None, tol=1e-5,
+            method="Newton-CG"):
+        self.penalty = penalty
+        self.max_iter = max_iter
+        self.tol = tol
+        self.method = method
+        self.params = np.zeros(0)
+        self._idx = dict()  # Maps (winner, loser) to the edge index.
+        self._size = 0
+        self._winners = np.zeros(16, dtype=int)
+        self._losers = np.zeros(16, dtype=int)
+        self._counts = np.zeros(16, dtype=float)
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def n_items(self):
+        return len(self.params)
+
+    def update(self, winners, losers, counts=None):
+        """Add a batch of comparisons, `winners[k]` beating `losers[k]`."""
+        winners, losers, counts, n_items = _edges(
+                (winners, losers) if counts is None
+                else (winners, losers, counts))
+        # Aggregate the batch, then merge it into the existing edges.
+        pairs, inv = np.unique(
+                np.stack((winners, losers)), axis=1, return_inverse=True)
+        counts = np.bincount(inv.ravel(), weights=counts)
+        for (winner, loser), count in zip(pairs.T.tolist(), counts):
+            k = self._idx.get((winner, loser))
+            if k is None:
+                k = self._append(winner, loser)
+            self._counts[k] += count
+        if n_items > self.n_items:
+            self.params = np.concatenate(
+                    (self.params, np.zeros(n_items - self.n_items)))
+
+    def fit(self, diagnostics=None, callback=None):
+        """Refit the model, starting from the current estimates.
+
+        `diagnostics` and `callback` are as in `thurstone_mle`.
+        """
+        fcts = _SparseFunctions(
+                self._winners[:self._size], self._losers[:self._size],
+                self._counts[:self._size], self.penalty)
+        self.params = _minimize(fcts, self.params, self.method, self.tol,
+                self.max_iter, diagnostics, callback).x
+        return self.params
+
+    def _append(self, winner, loser):
+        if self._size == len(self._counts):
+            # Double the capacity, so that appends take amortized O(1) time.
+            self._winners = np.concatenate((self._winners, self._winners))
+            self._losers = np.concatenate((self._losers, self._losers))
+            self._counts = np.concatenate(
+                    (self._counts, np.zeros(len(self._counts))))
+        k = self._size
+        self._winners[k] = winner
+        self._losers[k] = loser
+        self._idx[(winner, loser)] = k
+        self._size += 1
+        return k